@@ -0,0 +1,176 @@
+"""Admission control for the upstream-bound endpoints of a worker.
+
+At most capacity() requests run at once: ADMISSION_MAX_IN_FLIGHT, lowered to the upstream scheduler's
+current adaptive limits, so when providers push back with 429s fewer requests are let in instead of
+piling up behind them. Up to ADMISSION_QUEUE_SIZE more wait for a slot, interactive chat ahead of bulk
+traffic, which may only fill ADMISSION_BULK_QUEUE_SIZE of the queue. Anything beyond that, or waiting
+longer than ADMISSION_QUEUE_TIMEOUT, is turned away at once with a 503 and a Retry-After estimated from
+how fast the queue has been draining.
+"""
+import os
+import math
+import functools
+import threading
+import logging
+from collections import deque
+from time import monotonic, perf_counter
+from flask import current_app, jsonify, request
+import metrics
+import upstream
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 64))  # per worker, before provider limits
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 128))  # requests waiting for a slot
+ADMISSION_BULK_QUEUE_SIZE = int(os.environ.get("ADMISSION_BULK_QUEUE_SIZE", 32))  # of which bulk requests
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10))  # seconds a request may wait
+ADMISSION_MAX_RETRY_AFTER = 60  # seconds
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+ADMISSION_WAIT_SECONDS = metrics.Histogram("admission_wait_seconds", "Time admitted requests waited for a slot",
+                                           ("priority",))
+ADMISSION_SHED = metrics.Counter("admission_shed_total", "Requests turned away with a 503, by reason",
+                                 ("priority", "reason"))
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight, queue_size, bulk_queue_size, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.bulk_queue_size = bulk_queue_size
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._queues = {INTERACTIVE: deque(), BULK: deque()}
+        self._in_flight = 0
+        self._interval = None  # smoothed seconds between completions while requests were queued
+        self._last_release = None
+        self._admitted = {INTERACTIVE: 0, BULK: 0}
+        self._shed = {INTERACTIVE: 0, BULK: 0}
+
+    def capacity(self):
+        # Tied to what the providers currently accept, so the worker sheds load as they back off
+        return max(1, min(self.max_in_flight, upstream.concurrency_limit("gemini"), upstream.concurrency_limit("azure")))
+
+    def _waiting(self):
+        return len(self._queues[INTERACTIVE]) + len(self._queues[BULK])
+
+    def _dispatch(self):
+        # Called with _lock held: hand free slots to waiters, interactive first, FIFO within a priority
+        capacity = self.capacity()
+        while self._in_flight < capacity:
+            queue = self._queues[INTERACTIVE] or self._queues[BULK]
+            if not queue:
+                return
+            waiter = queue.popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            waiter.event.set()
+
+    def retry_after(self):
+        """Seconds until a request arriving now would likely get a slot, from the observed drain rate."""
+        with self._lock:
+            waiting = self._waiting()
+            interval = self._interval
+        if interval is None:
+            return max(1, math.ceil(self.queue_timeout))
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER, math.ceil((waiting + 1) * interval)))
+
+    def acquire(self, priority):
+        """Wait for a slot; returns True once admitted, False if the request should be shed."""
+        with self._lock:
+            ahead = len(self._queues[INTERACTIVE]) if priority == INTERACTIVE else self._waiting()
+            if not ahead and self._in_flight < self.capacity():
+                self._in_flight += 1
+                self._admitted[priority] += 1
+                return True
+            limit = self.queue_size if priority == INTERACTIVE else min(self.queue_size, self.bulk_queue_size)
+            queued = self._waiting() if priority == INTERACTIVE else len(self._queues[BULK])
+            if queued >= limit or self._waiting() >= self.queue_size:
+                self._shed[priority] += 1
+                ADMISSION_SHED.inc(1, priority, "queue_full")
+                return False
+            waiter = _Waiter()
+            self._queues[priority].append(waiter)
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.granted:
+                self._admitted[priority] += 1
+                return True
+            self._queues[priority].remove(waiter)
+            self._shed[priority] += 1
+        ADMISSION_SHED.inc(1, priority, "timeout")
+        return False
+
+    def release(self):
+        with self._lock:
+            now = monotonic()
+            if self._waiting() and self._last_release is not None:
+                # Only intervals measured under backlog tell how fast the queue drains
+                sample = now - self._last_release
+                self._interval = sample if self._interval is None else 0.8 * self._interval + 0.2 * sample
+            self._last_release = now
+            self._in_flight -= 1
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "capacity": self.capacity(),
+                "in_flight": self._in_flight,
+                "waiting_interactive": len(self._queues[INTERACTIVE]),
+                "waiting_bulk": len(self._queues[BULK]),
+                "admitted": dict(self._admitted),
+                "shed": dict(self._shed),
+                "drain_per_second": round(1 / self._interval, 2) if self._interval else None,
+            }
+
+
+controller = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_BULK_QUEUE_SIZE,
+                                 ADMISSION_QUEUE_TIMEOUT)
+
+
+def admit(priority_of):
+    """Decorate a Flask view so it only runs once admitted; priority_of() classifies the current request.
+
+    The slot is held until the response is closed, so streamed responses keep it until their last event.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            priority = priority_of()
+            start = perf_counter()
+            if not controller.acquire(priority):
+                retry_after = controller.retry_after()
+                logger.error(f"Shedding {priority} request to {request.path}, retry after {retry_after}s")
+                response = jsonify({
+                    "error": "Service Overloaded",
+                    "details": f"The server is at capacity, retry after {retry_after} seconds",
+                    "api": "Admission Control",
+                })
+                response.status_code = 503
+                response.headers["Retry-After"] = str(retry_after)
+                return response
+            ADMISSION_WAIT_SECONDS.observe(perf_counter() - start, priority)
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                controller.release()
+                raise
+            response.call_on_close(controller.release)
+            return response
+        return wrapper
+    return decorator
+
+
+def stats():
+    return controller.stats()
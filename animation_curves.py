@@ -0,0 +1,162 @@
+"""Server-side compiler from synthesis timing events to fixed-FPS blendshape keyframe tracks.
+
+Instead of every client turning raw Azure viseme ids into lip-sync curves frame by frame, the
+collected timeline is compiled once here with vectorized NumPy interpolation and smoothing:
+each viseme is a target mouth pose (a row of the viseme-to-blendshape table) reached at its
+onset, poses are linearly interpolated between onsets and smoothed with a Gaussian kernel.
+Bookmarks (Head-Tilt, Brow-L-Raise, Blink...) become attack/hold/release envelopes on their own
+tracks, so one set of tracks drives the whole face.
+
+The table can be replaced with a JSON file (VISEME_BLENDSHAPE_TABLE) of the form
+{"blendshapes": [...], "visemes": {"<id>": {"<blendshape>": weight}}, "bookmarks": {"<mark>": {"<track>": weight}}}.
+"""
+import os
+import json
+import logging
+import numpy as np
+from timeline import TICKS_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+ANIMATION_FPS = int(os.environ.get("ANIMATION_FPS", 30))
+ANIMATION_MAX_FPS = 120
+ANIMATION_SMOOTHING = float(os.environ.get("ANIMATION_SMOOTHING", 0.03))  # Gaussian sigma in seconds, 0 disables
+VISEME_BLENDSHAPE_TABLE = os.environ.get("VISEME_BLENDSHAPE_TABLE")
+
+# Bookmark envelope in seconds: ramp up, hold at full weight, ramp down
+BOOKMARK_ATTACK = 0.15
+BOOKMARK_HOLD = 0.4
+BOOKMARK_RELEASE = 0.3
+
+# Azure en-US viseme ids: https://learn.microsoft.com/en-us/azure/ai-services/speech-service/how-to-speech-synthesis-viseme
+DEFAULT_TABLE = {
+    "blendshapes": ["jawOpen", "mouthFunnel", "mouthPucker", "mouthStretch", "mouthClose", "mouthSmile", "tongueOut"],
+    "visemes": {
+        "0": {},                                                     # silence
+        "1": {"jawOpen": 0.5, "mouthStretch": 0.2},                  # æ, ə, ʌ
+        "2": {"jawOpen": 0.8},                                       # ɑ
+        "3": {"jawOpen": 0.6, "mouthFunnel": 0.4},                   # ɔ
+        "4": {"jawOpen": 0.4, "mouthStretch": 0.3},                  # ɛ, ʊ
+        "5": {"jawOpen": 0.3, "mouthFunnel": 0.3},                   # ɝ
+        "6": {"jawOpen": 0.2, "mouthStretch": 0.5, "mouthSmile": 0.3},  # j, i, ɪ
+        "7": {"jawOpen": 0.2, "mouthPucker": 0.8},                   # w, u
+        "8": {"jawOpen": 0.4, "mouthFunnel": 0.6},                   # o
+        "9": {"jawOpen": 0.7, "mouthFunnel": 0.3},                   # aʊ
+        "10": {"jawOpen": 0.5, "mouthFunnel": 0.5},                  # ɔɪ
+        "11": {"jawOpen": 0.7, "mouthStretch": 0.3},                 # aɪ
+        "12": {"jawOpen": 0.4},                                      # h
+        "13": {"jawOpen": 0.2, "mouthFunnel": 0.4},                  # ɹ
+        "14": {"jawOpen": 0.3, "tongueOut": 0.3},                    # l
+        "15": {"jawOpen": 0.1, "mouthStretch": 0.4},                 # s, z
+        "16": {"jawOpen": 0.2, "mouthFunnel": 0.5},                  # ʃ, tʃ, dʒ, ʒ
+        "17": {"jawOpen": 0.2, "tongueOut": 0.6},                    # ð
+        "18": {"jawOpen": 0.1, "mouthClose": 0.4},                   # f, v
+        "19": {"jawOpen": 0.2, "tongueOut": 0.2},                    # d, t, n, θ
+        "20": {"jawOpen": 0.3},                                      # k, g, ŋ
+        "21": {"mouthClose": 1.0},                                   # p, b, m
+    },
+    # Marks not listed here drive a track named after the mark itself
+    "bookmarks": {},
+}
+
+
+def load_table(path=VISEME_BLENDSHAPE_TABLE):
+    if not path:
+        return DEFAULT_TABLE
+    try:
+        with open(path) as f:
+            table = json.load(f)
+        logger.info(f"Loaded viseme-to-blendshape table from {path} with {len(table['blendshapes'])} blendshapes")
+        return table
+    except Exception as e:
+        logger.error(f"Failed to load viseme-to-blendshape table {path}, using the default: {str(e)}")
+        return DEFAULT_TABLE
+
+
+_table = load_table()
+
+
+def _pose_matrix(table):
+    # Row per viseme id, column per blendshape; unknown ids map to the neutral (all zero) pose
+    blendshapes = table["blendshapes"]
+    column = {name: i for i, name in enumerate(blendshapes)}
+    size = max([int(v) for v in table["visemes"]] + [21]) + 1
+    poses = np.zeros((size, len(blendshapes)), dtype=np.float32)
+    for viseme_id, weights in table["visemes"].items():
+        for name, weight in weights.items():
+            poses[int(viseme_id), column[name]] = weight
+    return blendshapes, poses
+
+
+def _smooth(tracks, fps, sigma):
+    # Gaussian smoothing of every track at once: edge-padded sliding windows dotted with the kernel
+    radius = int(round(3 * sigma * fps))
+    if radius < 1 or tracks.shape[0] == 0:
+        return tracks
+    offsets = np.arange(-radius, radius + 1, dtype=np.float32) / (sigma * fps)
+    kernel = np.exp(-0.5 * offsets ** 2)
+    kernel /= kernel.sum()
+    padded = np.pad(tracks, ((radius, radius), (0, 0)), mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1, axis=0)
+    return windows @ kernel
+
+
+def _viseme_tracks(times, ids, frame_times, poses):
+    # Each viseme's pose is reached at its onset and linearly blended towards the next one
+    if len(times) == 0:
+        return np.zeros((len(frame_times), poses.shape[1]), dtype=np.float32)
+    keys = poses[np.clip(ids, 0, len(poses) - 1)]
+    left = np.clip(np.searchsorted(times, frame_times, side="right") - 1, 0, len(times) - 1)
+    right = np.minimum(left + 1, len(times) - 1)
+    span = times[right] - times[left]
+    frac = np.where(span > 0, (frame_times - times[left]) / np.where(span > 0, span, 1), 0.0)
+    frac = np.clip(frac, 0.0, 1.0)[:, None]
+    tracks = keys[left] + frac * (keys[right] - keys[left])
+    # Before the first viseme the mouth blends in from the neutral pose
+    before = frame_times < times[0]
+    tracks[before] = 0.0
+    return tracks
+
+
+def _bookmark_envelopes(onsets, frame_times):
+    # Attack/hold/release envelope of every occurrence, overlapping occurrences take the maximum
+    dt = frame_times[None, :] - onsets[:, None]
+    attack = np.clip(dt / BOOKMARK_ATTACK, 0.0, 1.0)
+    release = np.clip(1.0 - (dt - BOOKMARK_ATTACK - BOOKMARK_HOLD) / BOOKMARK_RELEASE, 0.0, 1.0)
+    return np.where(dt >= 0, np.minimum(attack, release), 0.0).max(axis=0)
+
+
+def compile_curves(timeline, duration=None, fps=ANIMATION_FPS, smoothing=ANIMATION_SMOOTHING, table=None):
+    """Compile a TimelineCollector into {"fps", "frame_count", "tracks": {name: [weights per frame]}}."""
+    table = _table if table is None else table
+    fps = max(1, min(int(fps), ANIMATION_MAX_FPS))
+    blendshapes, poses = _pose_matrix(table)
+
+    viseme_times = np.asarray(timeline.viseme_ticks, dtype=np.float64) / TICKS_PER_SECOND
+    viseme_ids = np.asarray(timeline.viseme_ids, dtype=np.int64)
+    bookmark_times = np.asarray(timeline.bookmark_ticks, dtype=np.float64) / TICKS_PER_SECOND
+    if not duration:
+        # Cached entries from older versions don't know their duration, end after the last event settles
+        last = max([viseme_times[-1] if len(viseme_times) else 0.0,
+                    bookmark_times[-1] if len(bookmark_times) else 0.0])
+        duration = last + BOOKMARK_ATTACK + BOOKMARK_HOLD + BOOKMARK_RELEASE
+
+    frame_count = int(np.ceil(duration * fps)) + 1
+    frame_times = np.arange(frame_count, dtype=np.float64) / fps
+
+    mouth = _viseme_tracks(viseme_times, viseme_ids, frame_times, poses)
+    if smoothing > 0:
+        mouth = _smooth(mouth, fps, smoothing)
+    tracks = {name: mouth[:, i] for i, name in enumerate(blendshapes)}
+
+    marks = np.asarray(timeline.marks, dtype=object)
+    for mark in dict.fromkeys(timeline.marks):
+        envelope = _bookmark_envelopes(bookmark_times[marks == mark], frame_times)
+        for track, weight in table.get("bookmarks", {}).get(mark, {mark: 1.0}).items():
+            tracks[track] = np.maximum(tracks[track], weight * envelope) if track in tracks else weight * envelope
+
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "tracks": {name: np.round(values, 3).tolist() for name, values in tracks.items()},
+    }
@@ -1,15 +1,32 @@
-from flask import Flask, request, jsonify
+import time
+_import_started = time.perf_counter()  # the startup report in /api/stats covers the whole app import
+from flask import Flask, Response, abort, g, request, jsonify, send_file, stream_with_context, url_for
 from flask_cors import CORS
+import asyncio
 import base64
-import openai
 import json
 import os
 import re
 import logging
-import html
-from google import genai
-from google.genai import types
-import azure.cognitiveservices.speech as speechsdk
+import queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+import admission
+import animation_curves
+import audio_formats
+import audio_store
+import client_pool
+import fillers
+import generation_cache
+import metrics
+import prompts
+import script_context
+import script_jobs
+import sessions
+import ssml
+from timeline import TICKS_PER_SECOND, TIMING_FORMATS, TimelineCollector, event_dict
+import tts_cache
+import upstream
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -331,7 +348,807 @@ system_instruction="""# Instruction Prompt for LLM
                       #### Response in SSML:
                       <speak>Oh, my day’s been great, thanks for asking! <bookmark mark="Head-Tilt"/> <break time="300ms"/> How about yours? <bookmark mark="Brow-L-Raise"/> <prosody pitch="high">Anything exciting happen?</prosody> <bookmark mark="Pupils-Y"/></speak>"""
 
+system_instruction_session_summary="""# Instruction Prompt for Conversation Summaries
+
+                                      You keep the running summary of a conversation between a user and you, a friendly virtual character.
+
+                                      You are given the current summary (it may be empty) and the turns that follow it. Return the updated summary:
+                                      - Plain text, at most 150 words, written from your side ("The user told me...").
+                                      - Keep names, preferences, plans, feelings and open questions the user may come back to; drop greetings and small talk.
+                                      - Never drop facts from the current summary unless the new turns contradict them.
+                                      - Return only the summary, without headings or markup."""
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# Minified and versioned once here; generate_content sends these (or their cached-content handles), not the raw strings
+SPLIT_CONTEXT_PROMPT = prompts.register("split_context", system_instruction_split_context)
+DIRECT_RESPONSE_PROMPT = prompts.register("direct_response", system_instruction_directResponse)
+AI_RESPONSE_PROMPT = prompts.register("ai_response", system_instruction)
+SESSION_SUMMARY_PROMPT = prompts.register("session_summary", system_instruction_session_summary)
+
+# Gemini calls and Azure syntheses run as coroutines on each worker's upstream event loop
+# (client_pool.submit), so waiting on a provider holds no thread besides the request's own
+GEMINI_CALL_TIMEOUT = float(os.environ.get("GEMINI_CALL_TIMEOUT", 30))  # seconds, applied to each Gemini call
+
+# Longest a synthesis may take to complete, or a streaming one may go without producing any event
+AZURE_SYNTHESIS_TIMEOUT = float(os.environ.get("AZURE_SYNTHESIS_TIMEOUT", 60))  # seconds
+# Longest /api/respond waits for its synthesis: every attempt timing out, plus checkouts and retry delays
+AZURE_SYNTHESIS_DEADLINE = (upstream.UPSTREAM_RETRIES + 1) * (AZURE_SYNTHESIS_TIMEOUT
+                                                               + client_pool.SYNTHESIZER_CHECKOUT_TIMEOUT) \
+    + upstream.UPSTREAM_RETRIES * upstream.UPSTREAM_RETRY_MAX_DELAY
+
+# /api/respond/batch: items generating with Gemini and items synthesizing with Azure at once, per batch
+BATCH_GEMINI_CONCURRENCY = int(os.environ.get("BATCH_GEMINI_CONCURRENCY", 4))
+BATCH_AZURE_CONCURRENCY = int(os.environ.get("BATCH_AZURE_CONCURRENCY", 4))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 100))
+
+
+class PipelineError(Exception):
+    """A failed /api/respond stage, carrying the structured error JSON returned to the frontend."""
+
+    def __init__(self, error, details, api, status=500, upstream=True):
+        super().__init__(details)
+        self.error = error
+        self.details = details
+        self.api = api
+        self.status = status
+        self.upstream = upstream  # False for failures of our own checks and deadlines
+
+    def reported(self):
+        # Counted when the error reaches the client, not when raised: the scheduler retries most failed attempts
+        if self.upstream:
+            metrics.UPSTREAM_ERRORS.inc(1, self.api)
+
+    def to_dict(self):
+        return {"error": self.error, "details": self.details, "api": self.api}
+
+    def to_response(self):
+        self.reported()
+        return jsonify(self.to_dict()), self.status
+
+
+async def generate_content(client, prompt, question, response_schema=None):
+    types = client_pool.genai.types  # the SDK is loaded with the client
+    prompts.maintain(client, GEMINI_MODEL)
+    # Structured output: Gemini is constrained to JSON matching the schema instead of free text
+    structured = {"response_mime_type": "application/json", "response_schema": response_schema} if response_schema else {}
+    # Identical in-flight or recent generations share one upstream call (frontend retries, double-sends),
+    # which the scheduler rate limits, retries and hedges
+    return await generation_cache.get_or_generate(
+        GEMINI_MODEL, prompt.version, [question],
+        lambda: upstream.call("gemini", lambda: client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            config=types.GenerateContentConfig(
+                **prompt.config(),  # system_instruction, or cached_content once the prompt is cached
+                **structured,
+                http_options=types.HttpOptions(timeout=int(GEMINI_CALL_TIMEOUT * 1000))),  # per-call timeout in ms
+                #Add temprature for variability
+            contents=[question] #send the user input
+        )))
+
+
+async def generate_script_context(client, question):
+    """Generate and parse the video segmentation; returns (segments, style)."""
+    try:
+        logger.info("Generating script context with Gemini API")
+        splitContext = await generate_content(client, SPLIT_CONTEXT_PROMPT, question, script_context.SCHEMA) #using the Split context instruction here
+        logger.info("Successfully generated script context")
+    except Exception as e:
+        logger.error(f"Failed to generate script context with Gemini API: {str(e)}")
+        raise PipelineError(
+            "Script Context Generation Failed",
+            f"Gemini API call for script context failed: {str(e)}",
+            "Google Gemini (Script Context)")
+    try:
+        segments, style, repaired = script_context.parse(splitContext.text)
+        script_context.PARSE_OUTCOMES.inc(1, "repaired" if repaired else "ok")
+        logger.info(f"Successfully parsed {len(segments)} segments with style: {style}")
+        return segments, style
+    except script_context.ScriptContextError as e:
+        logger.error(f"Invalid script context JSON, retrying once: {str(e)}")
+        logger.error(f"Raw input: {(splitContext.text or '')[:500]}...")  # Log first 500 chars for debugging
+
+    # One more generation; the changed question keeps the generation cache from returning the same output
+    try:
+        splitContext = await generate_content(
+            client, SPLIT_CONTEXT_PROMPT,
+            question + "\n Return only the JSON object described above, with every field filled in.",
+            script_context.SCHEMA)
+        segments, style, _ = script_context.parse(splitContext.text)
+        script_context.PARSE_OUTCOMES.inc(1, "retried")
+        logger.info(f"Parsed {len(segments)} segments with style: {style} after a retry")
+        return segments, style
+    except Exception as e:
+        # The reply itself is still good, it goes out without a storyboard
+        script_context.PARSE_OUTCOMES.inc(1, "failed")
+        logger.error(f"Script context still invalid after a retry, returning no segments: {str(e)}")
+        return [], script_context.DEFAULT_STYLE
+
+
+async def generate_ai_response(client, question, getAiResponse):
+    if(getAiResponse):
+        try:
+            logger.info("Generating AI response with Gemini API (full response)")
+            aiResponse = await generate_content(client, AI_RESPONSE_PROMPT, question) #using the SSML instructions prompt here
+            logger.info("Successfully generated AI response")
+            return aiResponse
+        except Exception as e:
+            logger.error(f"Failed to generate AI response with Gemini API: {str(e)}")
+            raise PipelineError(
+                "AI Response Generation Failed",
+                f"Gemini API call for AI response failed: {str(e)}",
+                "Google Gemini (AI Response)")
+    else:
+        try:
+            logger.info("Generating direct AI response with Gemini API (SSML only)")
+            aiResponse = await generate_content(client, DIRECT_RESPONSE_PROMPT, question) #using the SSML instructions prompt here
+            logger.info("Successfully generated direct AI response")
+            return aiResponse
+        except Exception as e:
+            logger.error(f"Failed to generate direct AI response with Gemini API: {str(e)}")
+            raise PipelineError(
+                "Direct AI Response Generation Failed",
+                f"Gemini API call for direct response failed: {str(e)}",
+                "Google Gemini (Direct Response)")
+
+
+def user_question(message):
+    question = "User Input:\n"
+    question += message
+    return question
+
+
+async def summarize_session(summary, turns):
+    # Background summary update of a session (sessions.record); errors are logged there
+    with metrics.Stage("gemini_session_summary"):
+        response = await generate_content(client_pool.get_gemini_client(), SESSION_SUMMARY_PROMPT,
+                                          sessions.summary_request(summary, turns))
+    return response.text or ""
+
+
+def remember_turn(session_id, message, textValue):
+    sessions.record(session_id, message, ssml.plain_text(textValue), summarize_session)
+
+
+async def script_context_job(client, question):
+    # Deferred getScriptContext: runs on the script_jobs pool, its record is polled from /api/script-context/<id>
+    with metrics.Stage("gemini_split_context"):
+        segments, style = await generate_script_context(client, question)
+    return {"splitContext": script_context.to_json(segments), "style": style}
+
+
+def build_generation_calls(client, message, getAiResponse, getScriptContext, timings=None, history=""):
+    question = user_question(message)
+
+    # The script context and the SSML response don't depend on each other, so both Gemini
+    # calls run at once and the request waits for the slower one instead of their sum.
+    # Only the reply sees the session history, the storyboard segments the reply's own script
+    calls = {"aiResponse": metrics.timed("gemini_ssml", partial(
+        generate_ai_response, client,
+        history + question + "\n Please generate the SSML-enhanced text based on this input.",
+        getAiResponse), timings)}
+    if(getScriptContext):
+        calls["splitContext"] = metrics.timed("gemini_split_context",
+                                              partial(generate_script_context, client, question), timings)
+    return calls
+
+
+async def run_fanout(calls, timeout=GEMINI_CALL_TIMEOUT):
+    """Run independent coroutine calls concurrently and return their results by name.
+
+    The first failure cancels every sibling that has not finished yet and is re-raised, so the
+    request fails as soon as any call fails instead of after the slowest one.
+    """
+    tasks = {asyncio.ensure_future(fn()): name for name, fn in calls.items()}
+    pending = set(tasks)
+    results = {}
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                names = ", ".join(sorted(tasks[t] for t in pending))
+                logger.error(f"Concurrent Gemini calls timed out after {timeout}s: {names}")
+                raise PipelineError(
+                    "Upstream Timeout",
+                    f"Gemini calls did not complete within {timeout}s: {names}",
+                    "Google Gemini (Fan-out)", status=504, upstream=False)
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                error = task.exception()
+                if error is not None:
+                    raise error
+                results[tasks[task]] = task.result()
+        return results
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def prepare_ssml(raw_text, personality, degree):
+    """Normalize and validate the generated SSML before anything is sent to Azure."""
+    logger.info("Starting Azure Speech Synthesis")
+    try:
+        return ssml.normalize(raw_text, client_pool.AZURE_VOICE_NAME, personality, degree)
+    except ssml.SSMLError as e:
+        logger.error(f"Rejected generated SSML: {str(e)}")
+        raise PipelineError("Invalid SSML", f"Generated SSML could not be repaired: {str(e)}", "SSML Validation",
+                            status=502, upstream=False)
+    except Exception as e:
+        logger.error(f"Failed during Azure Speech Synthesis: {str(e)}")
+        raise PipelineError(
+            "Azure Speech Synthesis Failed",
+            f"Speech synthesis API call failed: {str(e)}",
+            "Azure Speech Synthesis (Synthesis)")
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+async def checkout_synthesizer(audio_format):
+    """Check out a pooled synthesizer for synthesize_ssml, wired to a fresh timeline and completion future.
+
+    Returns (synthesizer_pool, synthesizer, timeline, finished). Passed to upstream.call as prepare, so the
+    wait for a free synthesizer isn't counted as Azure latency.
+    """
+    # Viseme/word/bookmark events are recorded as raw ticks, converted once when the reply is serialized
+    timeline = TimelineCollector()
+    # The completed/canceled callbacks resolve an asyncio future instead of blocking a thread on .get()
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+    on_finished = lambda evt: loop.call_soon_threadsafe(_resolve, finished, evt.result)
+    handlers = {**timeline.handlers(), "synthesis_completed": on_finished, "synthesis_canceled": on_finished}
+
+    #AZURE LOGIC:  Check out a pre-connected synthesizer from this worker's pool
+    try:
+        logger.info("Checking out pooled Azure speech synthesizer")
+        with metrics.Stage("azure_setup"):
+            synthesizer_pool = client_pool.get_synthesizer_pool(audio_format.sdk_name)
+            # Event handlers are attached for this request only and detached again on release
+            synthesizer = await synthesizer_pool.acquire_async(handlers)
+        logger.info("Successfully configured Azure Speech Synthesis")
+    except Exception as e:
+        logger.error(f"Failed to configure Azure Speech Synthesis: {str(e)}")
+        raise PipelineError(
+            "Azure Speech Synthesis Configuration Failed",
+            f"Failed to set up Azure speech configuration: {str(e)}",
+            "Azure Speech Synthesis (Configuration)")
+    return synthesizer_pool, synthesizer, timeline, finished
+
+
+async def synthesize_ssml(textValue, checkout):
+    """Synthesize one SSML document on a synthesizer checked out by checkout_synthesizer.
+
+    Returns the audio bytes, its duration in seconds and the TimelineCollector of its timing events.
+    """
+    synthesizer_pool, synthesizer, timeline, finished = checkout
+
+    # Synthesize speech from the input text
+    try:
+        logger.info("Sending SSML to Azure Speech Synthesis API")
+        synthesizer.speak_ssml_async(textValue) #speak_ssml_async or speak_text_async
+        result = await asyncio.wait_for(finished, AZURE_SYNTHESIS_TIMEOUT)
+        logger.info("Speech synthesis completed")
+    except asyncio.CancelledError:
+        # A sibling piece failed or the request went away, don't hand a busy synthesizer back
+        try:
+            synthesizer.stop_speaking_async()
+        except Exception:
+            pass
+        synthesizer_pool.release(synthesizer, discard=True)
+        raise
+    except asyncio.TimeoutError:
+        # Azure never reported completion or cancellation; the connection can't be trusted with another request
+        try:
+            synthesizer.stop_speaking_async()
+        except Exception:
+            pass
+        synthesizer_pool.release(synthesizer, discard=True)
+        logger.error(f"Azure Speech Synthesis did not complete within {AZURE_SYNTHESIS_TIMEOUT}s")
+        failure = PipelineError(
+            "Azure Speech Synthesis Failed",
+            f"Speech synthesis did not complete within {AZURE_SYNTHESIS_TIMEOUT}s",
+            "Azure Speech Synthesis (Synthesis)", status=504)
+        failure.upstream_code = "ServiceTimeout"  # retried by the scheduler like Azure's own timeouts
+        raise failure
+    except Exception as e:
+        synthesizer_pool.release(synthesizer, discard=True)
+        logger.error(f"Failed during Azure Speech Synthesis: {str(e)}")
+        raise PipelineError(
+            "Azure Speech Synthesis Failed",
+            f"Speech synthesis API call failed: {str(e)}",
+            "Azure Speech Synthesis (Synthesis)")
+    synthesizer_pool.release(synthesizer)
+
+    # Check synthesis result and retrieve audio and timings
+    try:
+        logger.info("Processing Azure Speech Synthesis results")
+        if result.reason == client_pool.speechsdk.ResultReason.SynthesizingAudioCompleted:
+            logger.info("Speech synthesis completed successfully, processing results")
+            return {
+                "audio_data": result.audio_data,  # Binary audio data
+                "audio_duration": synthesis_duration(result),
+                "timeline": timeline,
+            }
+        # Return error if synthesis fails
+        failure = synthesis_failure(result)
+    except Exception as e:
+        logger.error(f"Failed to process Azure Speech Synthesis results: {str(e)}")
+        raise PipelineError(
+            "Azure Speech Synthesis Result Processing Failed",
+            f"Failed to process synthesis results: {str(e)}",
+            "Azure Speech Synthesis (Result Processing)")
+    raise failure
+
+
+def synthesis_duration(result):
+    duration = getattr(result, "audio_duration", None)
+    if duration:
+        return duration.total_seconds()
+    # Older SDKs don't report the duration, derive it from the PCM data instead
+    return audio_formats.riff_duration(result.audio_data) or 0.0
+
+
+async def synthesize_ssml_pipelined(textValue, audio_format):
+    """Synthesize a long SSML reply sentence-by-sentence in parallel and stitch the pieces back together.
+
+    Returns the same result as synthesize_ssml; short replies are synthesized in one call.
+    """
+    # Ogg/WebM containers can't be joined back-to-back, those replies are synthesized in one call
+    if audio_format.concatenable:
+        # More pieces than free synthesizers would only queue behind each other (and other requests)
+        available = client_pool.get_synthesizer_pool(audio_format.sdk_name).available()
+        pieces = ssml.split_ssml(textValue, max_pieces=max(1, min(ssml.SSML_MAX_PIECES, available)))
+    else:
+        pieces = [textValue]
+    if len(pieces) == 1:
+        return await upstream.call("azure", partial(synthesize_ssml, textValue),
+                                   prepare=partial(checkout_synthesizer, audio_format))
+
+    logger.info(f"Synthesizing {len(pieces)} SSML pieces in parallel")
+    # Each piece is scheduled (and retried) on its own
+    tasks = [asyncio.ensure_future(upstream.call("azure", partial(synthesize_ssml, piece),
+                                                 prepare=partial(checkout_synthesizer, audio_format)))
+             for piece in pieces]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()  # no-op for finished pieces
+    for task in tasks:
+        if task in done and task.exception() is not None:
+            raise task.exception()
+    results = [task.result() for task in tasks]
+
+    # Shift every piece's events by the audio that precedes it in the stitched reply
+    offset = 0.0
+    timeline = TimelineCollector()
+    for piece in results:
+        timeline.extend(piece["timeline"], round(offset * TICKS_PER_SECOND))
+        offset += piece["audio_duration"]
+    logger.info(f"Stitched {len(pieces)} SSML pieces into {offset:.2f}s of audio")
+    return {
+        "audio_data": audio_formats.concat_audio([piece["audio_data"] for piece in results]),
+        "audio_duration": offset,
+        "timeline": timeline,
+    }
+
+
+def synthesis_failure(result):
+    logger.error(f"Azure Speech Synthesis failed with reason: {result.reason}")
+    error_message = f"Synthesis failed with reason: {result.reason}"
+    if result.reason == client_pool.speechsdk.ResultReason.Canceled:
+        cancellation_details = client_pool.speechsdk.SpeechSynthesisCancellationDetails(result)
+        error_message += f", ErrorCode: {cancellation_details.error_code}, Details: {cancellation_details.error_details}"
+        logger.error(f"Synthesis cancellation details: {cancellation_details.error_details}")
+        failure = PipelineError("Azure Speech Synthesis Failed", error_message, "Azure Speech Synthesis (Result Processing)")
+        failure.upstream_code = cancellation_details.error_code.name  # lets the scheduler retry transient failures
+        return failure
+    return PipelineError("Azure Speech Synthesis Failed", error_message, "Azure Speech Synthesis (Result Processing)")
+
+
+def ndjson(event):
+    return json.dumps(event, separators=(",", ":")) + "\n"
+
+
+def stream_ssml_synthesis(textValue, audio_format):
+    """Synthesize one SSML document, yielding NDJSON audio chunks and timing events as Azure produces them.
+
+    The generator's return value is the same synthesis dict synthesize_ssml returns, so it can be cached.
+    """
+    # Not retried or hedged, but it holds an Azure slot like any other synthesis, and its 429s count
+    try:
+        with upstream.slot("azure", client_pool.SYNTHESIZER_CHECKOUT_TIMEOUT):
+            return (yield from _stream_ssml_synthesis(textValue, audio_format))
+    except upstream.SlotTimeout as e:
+        logger.error(f"Streaming synthesis not started: {str(e)}")
+        raise PipelineError("Service Overloaded", f"Speech synthesis could not start: {str(e)}",
+                            "Azure Speech Synthesis (Configuration)", status=503, upstream=False)
+
+
+def _stream_ssml_synthesis(textValue, audio_format):
+    updates = queue.Queue()
+    timeline = TimelineCollector()
+
+    # SDK callbacks run on Azure's threads, they only hand events over to the streaming generator
+    handlers = {
+        "synthesizing": lambda evt: updates.put(("audio", evt.result.audio_data)),
+        "viseme_received": lambda evt: updates.put(("viseme", evt)),
+        "synthesis_word_boundary": lambda evt: updates.put(("word", evt)),
+        "bookmark_reached": lambda evt: updates.put(("bookmark", evt)),
+        "synthesis_completed": lambda evt: updates.put(("done", evt.result)),
+        "synthesis_canceled": lambda evt: updates.put(("done", evt.result)),
+    }
+    try:
+        logger.info("Checking out pooled Azure speech synthesizer for streaming")
+        with metrics.Stage("azure_setup"):
+            synthesizer_pool = client_pool.get_synthesizer_pool(audio_format.sdk_name)
+            synthesizer = synthesizer_pool.acquire(handlers)
+    except Exception as e:
+        logger.error(f"Failed to configure Azure Speech Synthesis: {str(e)}")
+        raise PipelineError(
+            "Azure Speech Synthesis Configuration Failed",
+            f"Failed to set up Azure speech configuration: {str(e)}",
+            "Azure Speech Synthesis (Configuration)")
+
+    completed = False
+    try:
+        logger.info("Sending SSML to Azure Speech Synthesis API (streaming)")
+        synthesizer.speak_ssml_async(textValue)
+
+        while True:
+            try:
+                update = updates.get(timeout=AZURE_SYNTHESIS_TIMEOUT)
+            except queue.Empty:
+                raise PipelineError(
+                    "Azure Speech Synthesis Failed",
+                    f"Speech synthesis produced no events within {AZURE_SYNTHESIS_TIMEOUT}s",
+                    "Azure Speech Synthesis (Synthesis)")
+            kind = update[0]
+            if kind == "audio":
+                yield ndjson({"type": "audio", "audio": base64.b64encode(update[1]).decode('utf-8')})
+            elif kind == "done":
+                result = update[1]
+                break
+            else:
+                evt = update[1]
+                if kind == "viseme":
+                    timeline.on_viseme(evt)
+                    value = evt.viseme_id
+                elif kind == "word":
+                    timeline.on_word(evt)
+                    value = evt.text
+                else:
+                    timeline.on_bookmark(evt)
+                    value = evt.text
+                yield ndjson(event_dict(kind, evt.audio_offset, value))
+        completed = True
+    finally:
+        if not completed:
+            # Client went away or synthesis failed mid-stream, don't hand a busy synthesizer back
+            try:
+                synthesizer.stop_speaking_async()
+            except Exception:
+                pass
+        synthesizer_pool.release(synthesizer, discard=not completed)
+
+    logger.info("Speech synthesis stream completed")
+    if result.reason != client_pool.speechsdk.ResultReason.SynthesizingAudioCompleted:
+        raise synthesis_failure(result)
+    return {
+        "audio_data": result.audio_data,
+        "audio_duration": synthesis_duration(result),
+        "timeline": timeline,
+    }
+
+
+def await_generation(futures, name, deadline):
+    try:
+        return futures[name].result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        logger.error(f"Gemini call {name} timed out")
+        raise PipelineError(
+            "Upstream Timeout",
+            f"Gemini calls did not complete within {GEMINI_CALL_TIMEOUT}s: {name}",
+            "Google Gemini (Fan-out)", status=504, upstream=False)
+
+
+def stream_respond(calls, personality, degree, audio_format_name, animation_fps=None, script_job=None,
+                   filler=False, on_reply=None, session_id=None):
+    """NDJSON event stream for /api/respond with "stream": true.
+
+    With filler set, a pre-synthesized filler line matching the personality comes first (if the bank
+    has one), so the character reacts while Gemini works. Then emits ai_response as soon as Gemini returns, then audio chunks interleaved with viseme/word/bookmark
+    events as Azure produces them, then the compiled animation_curves when animation_fps is set, then
+    splitContext, then done. Failures are emitted as an error event
+    carrying the usual error JSON fields, since the 200 status has already been sent.
+    A deferred script context job (script_job, its id) is announced first and its result pushed as the
+    splitContext event if it finishes in time; otherwise the client polls /api/script-context/<id>.
+    on_reply, if set, is called with the SSML reply once everything was sent (to record the session turn);
+    session_id, if set, is returned in the ai_response event.
+    """
+    futures = {name: client_pool.submit(fn()) for name, fn in calls.items()}
+    deadline = time.monotonic() + GEMINI_CALL_TIMEOUT
+    try:
+        if filler:
+            entry = fillers.get(personality, degree, audio_format_name)
+            if entry is not None:
+                yield ndjson({"type": "filler", **entry.to_dict(audio_format_name)})
+        if script_job is not None:
+            yield ndjson({"type": "script_context_job", "script_context_id": script_job,
+                          "script_context_url": script_job_url(script_job)})
+        aiResponse = await_generation(futures, "aiResponse", deadline)
+        textValue = prepare_ssml(aiResponse.text, personality, degree)
+        event = {"type": "ai_response", "ai_response": textValue, "audio_format": audio_format_name}
+        if session_id is not None:
+            event["sessionId"] = session_id
+        yield ndjson(event)
+
+        audio_format = audio_formats.OUTPUT_FORMATS[audio_format_name]
+        key = tts_cache.cache_key(textValue, client_pool.AZURE_VOICE_NAME, audio_format.sdk_name)
+        synthesis = tts_cache.get(key)
+        if synthesis is None:
+            synthesis = yield from stream_ssml_synthesis(textValue, audio_format)
+            tts_cache.put(key, synthesis)
+            metrics.AUDIO_SECONDS.observe(synthesis["audio_duration"], "synthesized")
+        else:
+            logger.info("Serving speech synthesis stream from TTS cache")
+            metrics.AUDIO_SECONDS.observe(synthesis["audio_duration"] or 0.0, "cache")
+            yield ndjson({"type": "audio", "audio": base64.b64encode(synthesis["audio_data"]).decode('utf-8')})
+            for event in synthesis["timeline"].events():
+                yield ndjson(event)
+        if animation_fps:
+            curves = animation_curves.compile_curves(synthesis["timeline"], synthesis["audio_duration"], animation_fps)
+            yield ndjson({"type": "animation_curves", "animation_curves": curves})
+
+        if script_job is not None:
+            record = script_jobs.wait(script_job, max(0.0, deadline - time.monotonic())) or {}
+            if record.get("status") == "done":
+                yield ndjson({"type": "splitContext", "splitContext": record["splitContext"], "style": record["style"]})
+            elif record.get("status") == "failed":
+                # Only the storyboard failed, the reply itself is complete
+                yield ndjson({"type": "script_context_error", "error": record["error"],
+                              "details": record["details"], "api": record["api"]})
+        else:
+            if "splitContext" in futures:
+                segments, style = await_generation(futures, "splitContext", deadline)
+            else:
+                segments, style = [], 'realistic'
+            yield ndjson({"type": "splitContext", "splitContext": script_context.to_json(segments), "style": style})
+        if on_reply is not None:
+            on_reply(textValue)  # only now the user has heard the whole reply
+        yield ndjson({"type": "done"})
+        logger.info("Successfully streamed all synthesis results")
+    except PipelineError as e:
+        e.reported()
+        yield ndjson({"type": "error", "error": e.error, "details": e.details, "api": e.api})
+    except Exception as e:
+        logger.error(f"Unexpected error while streaming /api/respond: {str(e)}")
+        yield ndjson({"type": "error", "error": "Internal Server Error",
+                      "details": f"An unexpected error occurred: {str(e)}", "api": "General Error Handler"})
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+def parse_respond_options(data):
+    """Validate the /api/respond options of a request (or batch item).
+
+    Returns (options, None), or (None, details) for an "Invalid Request" error.
+    """
+    message = data.get("message")
+    if not message:
+        return None, "No message provided"
+    options = {
+        "message": message,
+        "personality": data.get("personality", "cheerful"),
+        "degree": data.get("styledegree", "1"),
+        "getAiResponse": data.get("getAiResponse", True),
+        "getScriptContext": data.get("getScriptContext", True),
+        "audioFormat": data.get("audioFormat", audio_formats.DEFAULT_AUDIO_FORMAT),
+        "timingFormat": data.get("timingFormat", "objects"),
+        "audioDelivery": data.get("audioDelivery", audio_store.AUDIO_DELIVERY_DEFAULT),
+        "animation_fps": None,
+        "filler": data.get("filler", False),
+    }
+    if options["audioFormat"] not in audio_formats.OUTPUT_FORMATS:
+        return None, f"audioFormat must be one of {', '.join(audio_formats.OUTPUT_FORMATS)}"
+    if options["timingFormat"] not in TIMING_FORMATS:
+        return None, f"timingFormat must be one of {', '.join(TIMING_FORMATS)}"
+    if options["audioDelivery"] not in audio_store.AUDIO_DELIVERY_MODES:
+        return None, f"audioDelivery must be one of {', '.join(audio_store.AUDIO_DELIVERY_MODES)}"
+    if data.get("animationCurves", False):
+        animation_fps = data.get("animationFps", animation_curves.ANIMATION_FPS)
+        if isinstance(animation_fps, bool) or not isinstance(animation_fps, int) or not 1 <= animation_fps <= animation_curves.ANIMATION_MAX_FPS:
+            return None, f"animationFps must be an integer between 1 and {animation_curves.ANIMATION_MAX_FPS}"
+        options["animation_fps"] = animation_fps
+    return options, None
+
+
+def build_reply(options, textValue, synthesis, segments, style, curves=None, script_job=None):
+    """The /api/respond JSON body; needs a request context for the audio and job URLs."""
+    if options["audioDelivery"] == "url":
+        # Audio is served as binary from /api/audio/<id> instead of inflating the JSON body
+        artifact_id = audio_store.put(synthesis["audio_data"], audio_formats.OUTPUT_FORMATS[options["audioFormat"]].extension)
+        audio_url = url_for("get_audio", artifact_id=artifact_id, _external=True)
+    else:
+        audio_url = base64.b64encode(synthesis["audio_data"]).decode('utf-8')# Convert audio data to base64 string
+    reply = {
+        "audio_url": audio_url,
+        "audio_format": options["audioFormat"],
+        "ai_response": textValue,
+        **synthesis["timeline"].to_timings(options["timingFormat"]),
+        "timing_format": options["timingFormat"],
+        "splitContext": script_context.to_json(segments) if segments is not None else None,
+        "style": style,
+    }
+    if curves is not None:
+        reply["animation_curves"] = curves
+    if script_job is not None:
+        reply["script_context_id"] = script_job
+        reply["script_context_url"] = script_job_url(script_job)
+    if options.get("sessionId"):
+        reply["sessionId"] = options["sessionId"]
+    return reply
+
+
+async def run_batch_item(client, options, gemini_slots, azure_slots):
+    """Run one /api/respond/batch item up to its synthesis, holding a Gemini slot then an Azure slot.
+
+    Slots are awaited before the per-call timeouts start, so queued items never time out while waiting.
+    """
+    loop = asyncio.get_running_loop()
+    getScriptContext = options["getScriptContext"]
+    script_job = None
+    if getScriptContext == "deferred":
+        # submit() writes the job record and may sweep expired ones, file I/O kept off the upstream loop
+        script_job = await loop.run_in_executor(
+            None, script_jobs.submit, partial(script_context_job, client, user_question(options["message"])))
+    calls = build_generation_calls(client, options["message"], options["getAiResponse"],
+                                   getScriptContext and script_job is None)
+    async with gemini_slots:
+        with metrics.Stage("gemini_fanout"):
+            results = await run_fanout(calls)
+    if script_job is not None:
+        segments, style = None, None
+    elif getScriptContext:
+        segments, style = results["splitContext"]
+    else:
+        segments, style = [], 'realistic'
+    textValue = prepare_ssml(results["aiResponse"].text, options["personality"], options["degree"])
+
+    audio_format = audio_formats.OUTPUT_FORMATS[options["audioFormat"]]
+    key = tts_cache.cache_key(textValue, client_pool.AZURE_VOICE_NAME, audio_format.sdk_name)
+    # The disk tier does file I/O, kept off the upstream loop
+    synthesis = await loop.run_in_executor(None, tts_cache.get, key)
+    if synthesis is None:
+        async with azure_slots:
+            with metrics.Stage("azure_synthesis"):
+                synthesis = await synthesize_ssml_pipelined(textValue, audio_format)
+        await loop.run_in_executor(None, tts_cache.put, key, synthesis)
+        metrics.AUDIO_SECONDS.observe(synthesis["audio_duration"], "synthesized")
+    else:
+        metrics.AUDIO_SECONDS.observe(synthesis["audio_duration"] or 0.0, "cache")
+    return {"textValue": textValue, "synthesis": synthesis, "segments": segments, "style": style,
+            "script_job": script_job}
+
+
+async def run_batch(client, items, results):
+    """Run the distinct batch items concurrently, putting (key, outcome) on the results queue as each finishes.
+
+    The outcome is run_batch_item's result or the exception it raised. Gemini and Azure slots are
+    separate, so one item's synthesis overlaps the next items' generations.
+    """
+    gemini_slots = asyncio.Semaphore(BATCH_GEMINI_CONCURRENCY)
+    azure_slots = asyncio.Semaphore(BATCH_AZURE_CONCURRENCY)
+
+    async def run(key, options):
+        try:
+            outcome = await run_batch_item(client, options, gemini_slots, azure_slots)
+        except Exception as e:
+            outcome = e
+        results.put((key, outcome))
+
+    tasks = [asyncio.ensure_future(run(key, options)) for key, options in items.items()]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()  # no-op unless the batch itself was cancelled
+
+
+def batch_error(index, status, error, details, api):
+    return ndjson({"type": "error", "index": index, "status": status, "error": error, "details": details, "api": api})
+
+
+def stream_batch(client, items, invalid):
+    """NDJSON event stream for /api/respond/batch.
+
+    items maps a dedupe key to (options, indexes of the items sharing them); invalid maps an index to
+    its validation error. Emits one result or error event per index as its item finishes, then done.
+    """
+    for index, details in invalid.items():
+        yield batch_error(index, 400, "Invalid Request", details, "Request Parsing")
+    results = queue.Queue()
+    batch = client_pool.submit(run_batch(client, {key: options for key, (options, _) in items.items()}, results))
+    batch.add_done_callback(lambda _: results.put(None))
+    failed = len(invalid)
+    try:
+        while True:
+            finished = results.get()
+            if finished is None:
+                break
+            key, outcome = finished
+            options, indexes = items[key]
+            if isinstance(outcome, Exception):
+                if isinstance(outcome, PipelineError):
+                    outcome.reported()
+                    status, error = outcome.status, outcome.to_dict()
+                else:
+                    logger.error(f"Unexpected error in /api/respond/batch item: {str(outcome)}")
+                    status, error = 500, {"error": "Internal Server Error",
+                                          "details": f"An unexpected error occurred: {str(outcome)}",
+                                          "api": "General Error Handler"}
+                failed += len(indexes)
+                for index in indexes:
+                    yield batch_error(index, status, **error)
+                continue
+            try:
+                curves = None
+                if options["animation_fps"]:
+                    curves = animation_curves.compile_curves(outcome["synthesis"]["timeline"],
+                                                             outcome["synthesis"]["audio_duration"],
+                                                             options["animation_fps"])
+                reply = build_reply(options, outcome["textValue"], outcome["synthesis"], outcome["segments"],
+                                    outcome["style"], curves, outcome["script_job"])
+            except Exception as e:
+                logger.error(f"Failed to process Azure Speech Synthesis results: {str(e)}")
+                failed += len(indexes)
+                for index in indexes:
+                    yield batch_error(index, 500, "Azure Speech Synthesis Result Processing Failed",
+                                      f"Failed to process synthesis results: {str(e)}",
+                                      "Azure Speech Synthesis (Result Processing)")
+                continue
+            # Duplicates share one generation and synthesis but each gets its own event
+            for index in indexes:
+                yield ndjson({"type": "result", "index": index, "status": 200, **reply})
+        total = len(invalid) + sum(len(indexes) for _, indexes in items.values())
+        logger.info(f"Finished batch of {total} items ({len(items)} distinct), {failed} failed")
+        yield ndjson({"type": "done", "items": total, "distinct": len(items), "errors": failed})
+    finally:
+        batch.cancel()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timings = {}  # stage name -> seconds, reported in the Server-Timing header
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint, str(response.status_code))
+    if not response.is_streamed:
+        # Streamed bodies are counted chunk by chunk as they are sent
+        size = response.calculate_content_length() or 0
+        metrics.RESPONSE_BYTES.inc(size, endpoint)
+        metrics.RESPONSE_SIZE.observe(size, endpoint)
+        if metrics.SERVER_TIMING and g.timings:
+            response.headers["Server-Timing"] = metrics.server_timing(g.timings)
+    return response
+
+def request_priority():
+    # Only background work waits behind chat: batches and requests that ask for it with "priority": "bulk"
+    if request.endpoint == "respond_batch":
+        return admission.BULK
+    data = request.get_json(silent=True) or {}
+    if data.get("priority") == admission.BULK:
+        return admission.BULK
+    return admission.INTERACTIVE
+
 @app.route("/api/respond", methods=["POST"])
+@admission.admit(request_priority)
 def respond():
     try:
         logger.info("Received request to /api/respond")
@@ -339,240 +1156,110 @@ def respond():
         if not data:
             return jsonify({"error": "Invalid Request", "details": "No JSON data provided", "api": "Request Parsing"}), 400
 
-        message = data.get("message")
-        if not message:
-            return jsonify({"error": "Invalid Request", "details": "No message provided", "api": "Request Parsing"}), 400
-
-        personality = data.get("personality", "cheerful")
-        degree = data.get("styledegree", "1")
-        getAiResponse = data.get("getAiResponse", True)
-        getScriptContext = data.get("getScriptContext", True)
+        options, invalid = parse_respond_options(data)
+        if invalid:
+            return jsonify({"error": "Invalid Request", "details": invalid, "api": "Request Parsing"}), 400
+        session_id = data.get("sessionId")
+        if session_id is not None and not sessions.valid_id(session_id):
+            return jsonify({"error": "Invalid Request", "details": "sessionId must be an id returned by this server",
+                            "api": "Request Parsing"}), 400
+        message = options["message"]
+        personality = options["personality"]
+        degree = options["degree"]
+        getAiResponse = options["getAiResponse"]
+        getScriptContext = options["getScriptContext"]
+        deferScriptContext = getScriptContext == "deferred"
+        audioFormat = options["audioFormat"]
+        audio_format = audio_formats.OUTPUT_FORMATS[audioFormat]
+        animation_fps = options["animation_fps"]
         logger.info(f"Processing request with personality: {personality}, getAiResponse: {getAiResponse}, getScriptContext: {getScriptContext}")
 
-        client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
-        aiResponse = ""
-        splitContext = ""
-        question = "User Input:\n"
-        question += message
-
-        # Handle script context generation with error handling
-        if(getScriptContext):
-            try:
-                logger.info("Generating script context with Gemini API")
-                splitContext = client.models.generate_content(
-                                model="gemini-2.0-flash",
-                                config=types.GenerateContentConfig(
-                                    system_instruction=system_instruction_split_context), #using the Split context instruction here
-                                    #Add temprature for variability
-                                contents=[question] #send the user input
-                    )
-                logger.info("Successfully generated script context")
-            except Exception as e:
-                logger.error(f"Failed to generate script context with Gemini API: {str(e)}")
-                return jsonify({
-                    "error": "Script Context Generation Failed",
-                    "details": f"Gemini API call for script context failed: {str(e)}",
-                    "api": "Google Gemini (Script Context)"
-                }), 500
-        question += "\n Please generate the SSML-enhanced text based on this input."
-
-        # Handle AI response generation with error handling
-        if(getAiResponse):
-            try:
-                logger.info("Generating AI response with Gemini API (full response)")
-                aiResponse = client.models.generate_content(
-                        model="gemini-2.0-flash",
-                        config=types.GenerateContentConfig(
-                            system_instruction=system_instruction), #using the SSML instructions prompt here
-                            #Add temprature for variability
-                        contents=[question] #send the user input
-                    )
-                logger.info("Successfully generated AI response")
-            except Exception as e:
-                logger.error(f"Failed to generate AI response with Gemini API: {str(e)}")
-                return jsonify({
-                    "error": "AI Response Generation Failed",
-                    "details": f"Gemini API call for AI response failed: {str(e)}",
-                    "api": "Google Gemini (AI Response)"
-                }), 500
+        client = client_pool.get_gemini_client()
+        # Deferred script context runs as a background job instead of joining the fan-out
+        script_job = None
+        if deferScriptContext:
+            script_job = script_jobs.submit(partial(script_context_job, client, user_question(message)))
+        # Conversations continue from the session's summary and recent turns; direct SSML conversion stays stateless
+        history = ""
+        if not getAiResponse:
+            session_id = None
         else:
-            try:
-                logger.info("Generating direct AI response with Gemini API (SSML only)")
-                aiResponse = client.models.generate_content(
-                        model="gemini-2.0-flash",
-                        config=types.GenerateContentConfig(
-                            system_instruction=system_instruction_directResponse), #using the SSML instructions prompt here
-                            #Add temprature for variability
-                        contents=[question] #send the user input
-                    )
-                logger.info("Successfully generated direct AI response")
-            except Exception as e:
-                logger.error(f"Failed to generate direct AI response with Gemini API: {str(e)}")
-                return jsonify({
-                    "error": "Direct AI Response Generation Failed",
-                    "details": f"Gemini API call for direct response failed: {str(e)}",
-                    "api": "Google Gemini (Direct Response)"
-                }), 500
-        def convert_response_to_list(input_json):
-            try:
-                logger.info("Parsing script context JSON response")
-                # Parse the entire JSON string into a Python dictionary
-                cleaned_input = input_json.strip()
-                if cleaned_input.startswith('```json') and cleaned_input.endswith('```'):
-                    cleaned_input = cleaned_input[7:-3].strip()  # Remove ```json and ```
-                elif cleaned_input.startswith('```') and cleaned_input.endswith('```'):
-                    cleaned_input = cleaned_input[3:-3].strip()  # Remove plain ```
-                data = json.loads(cleaned_input)
-                # Extract segments and script_scene_style
-                segments = data.get('segments', [])  # Default to empty list if missing
-                style = data.get('script_scene_style', 'realistic')  # Default to 'realistic' if missing
-                logger.info(f"Successfully parsed {len(segments)} segments with style: {style}")
-                return segments, style  # Return both as a tuple
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error for script context: {str(e)}")
-                logger.error(f"Raw input: {input_json[:500]}...")  # Log first 500 chars for debugging
-                return [], 'realistic'  # Return defaults on error
-            except Exception as e:
-                logger.error(f"Unexpected error parsing script context: {str(e)}")
-                return [], 'realistic'  # Return defaults on error
+            if session_id is not None:
+                with metrics.Stage("session_load", g.timings):
+                    history = sessions.history(session_id)
+            if session_id is None or history is None:
+                # A new conversation, or an id this server doesn't know (expired, or never minted here)
+                session_id, history = sessions.new_id(), ""
+        options["sessionId"] = session_id
+        calls = build_generation_calls(client, message, getAiResponse, getScriptContext and not deferScriptContext,
+                                       g.timings, history)
+        on_reply = partial(remember_turn, session_id, message) if session_id else None
+        if data.get("stream", False):
+            logger.info("Streaming response as NDJSON events")
+            events = stream_respond(calls, personality, degree, audioFormat, animation_fps, script_job,
+                                    options["filler"], on_reply, session_id)
+            return Response(stream_with_context(metrics.count_stream(events, "respond")),
+                            mimetype="application/x-ndjson")
+        try:
+            with metrics.Stage("gemini_fanout", g.timings):
+                results = client_pool.submit(run_fanout(calls)).result()
+        except PipelineError as e:
+            return e.to_response()
+        aiResponse = results["aiResponse"]
 
         # Usage
-        outputImagePrompts = convert_response_to_list(splitContext.text)
-        segments, style = outputImagePrompts  # Unpack the tuple
-        #AZURE LOGIC:  Set up speech configuration
+        if deferScriptContext:
+            segments, style = None, None  # fetched later from /api/script-context/<id>
+        elif(getScriptContext):
+            segments, style = results["splitContext"]
+        else:
+            segments, style = [], 'realistic'
+        # Build the final SSML document that is sent to Azure
         try:
-            logger.info("Setting up Azure Speech Synthesis configuration")
-            subscription_key = os.environ.get("AZURE_API_KEY")
-            if not subscription_key:
-                raise ValueError("AZURE_API_KEY environment variable not set")
-
-            region = "canadacentral"
-            speech_config = speechsdk.SpeechConfig(subscription=subscription_key, region=region)
-            speech_config.speech_synthesis_voice_name = "en-US-AriaNeural"
-
-            # Create speech synthesizer
-            synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-            logger.info("Successfully configured Azure Speech Synthesis")
-        except Exception as e:
-            logger.error(f"Failed to configure Azure Speech Synthesis: {str(e)}")
-            return jsonify({
-                "error": "Azure Speech Synthesis Configuration Failed",
-                "details": f"Failed to set up Azure speech configuration: {str(e)}",
-                "api": "Azure Speech Synthesis (Configuration)"
-            }), 500
+            with metrics.Stage("ssml_prepare", g.timings):
+                textValue = prepare_ssml(aiResponse.text, personality, degree)
+        except PipelineError as e:
+            return e.to_response()
+
+        # Identical SSML/voice/format always produces identical audio and timings, so a cache hit skips Azure
+        with metrics.Stage("tts_cache", g.timings):
+            key = tts_cache.cache_key(textValue, client_pool.AZURE_VOICE_NAME, audio_format.sdk_name)
+            synthesis = tts_cache.get(key)
+        if synthesis is None:
+            try:
+                with metrics.Stage("azure_synthesis", g.timings):
+                    future = client_pool.submit(synthesize_ssml_pipelined(textValue, audio_format))
+                    synthesis = future.result(timeout=AZURE_SYNTHESIS_DEADLINE)
+            except FutureTimeoutError:
+                future.cancel()  # releases the synthesizers and upstream slots the pieces hold
+                logger.error(f"Azure synthesis did not complete within {AZURE_SYNTHESIS_DEADLINE}s")
+                return PipelineError(
+                    "Upstream Timeout",
+                    f"Speech synthesis did not complete within {AZURE_SYNTHESIS_DEADLINE:.0f}s",
+                    "Azure Speech Synthesis (Synthesis)", status=504, upstream=False).to_response()
+            except PipelineError as e:
+                return e.to_response()
+            tts_cache.put(key, synthesis)
+            metrics.AUDIO_SECONDS.observe(synthesis["audio_duration"], "synthesized")
+        else:
+            logger.info("Serving speech synthesis from TTS cache")
+            metrics.AUDIO_SECONDS.observe(synthesis["audio_duration"] or 0.0, "cache")
+        # Recorded once there is audio, so a failed synthesis never leaves a turn the user didn't hear
+        if on_reply is not None:
+            on_reply(textValue)
 
-        # Initialize list to collect viseme and word timing events
-        events = []
-
-        def viseme_handler(evt):
-            offset_ms = evt.audio_offset / 10000  # Convert ticks to milliseconds
-            events.append({
-                "time": offset_ms,
-                "type": "viseme",
-                "value": evt.viseme_id
-            })
-        def word_handler(evt):
-            offset_ms = evt.audio_offset / 10000  # Convert ticks to milliseconds
-            events.append({
-                "time": offset_ms,
-                "type": "word",
-                "word": evt.text  # Captures the word text from the event
-            })
-        def bookmark_handler(evt):
-            offset_ms = evt.audio_offset / 10000  # Convert from ticks (100-ns units) to milliseconds
-            events.append({
-                "time": offset_ms,
-                "type": "bookmark",
-                "mark": evt.text  # The 'mark' attribute from the <bookmark> tag
-            })
-
-        # Attach event handlers
-        synthesizer.viseme_received.connect(viseme_handler)
-        synthesizer.bookmark_reached.connect(bookmark_handler)
-        synthesizer.synthesis_word_boundary.connect(word_handler)
-
-        # Synthesize speech from the input text
         try:
-            logger.info("Starting Azure Speech Synthesis")
-            textValue = aiResponse.text.strip()
-            if textValue.startswith('```xml\n'):
-                textValue = textValue.split('\n', 1)[1].rsplit('\n', 1)[0]
-
-            # Decode HTML entities to ensure word timings align with clean text
-            textValue = html.unescape(textValue)
-
-            # Ensure proper SSML header
-            if not textValue.startswith('<speak version='):
-                #https://learn.microsoft.com/en-us/azure/ai-services/speech-service/language-support?tabs=tts#voice-styles-and-roles
-                textValue = '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="en-US"><voice name="en-US-AriaNeural"><mstts:express-as style="' + personality + '" styledegree="' + degree + '">' + textValue[7:-8] + '</mstts:express-as></voice></speak>'
-
-            logger.info("Sending SSML to Azure Speech Synthesis API")
-            result = synthesizer.speak_ssml_async(textValue).get() #speak_ssml_async or speak_text_async
-            logger.info("Speech synthesis completed")
-        except Exception as e:
-            logger.error(f"Failed during Azure Speech Synthesis: {str(e)}")
-            return jsonify({
-                "error": "Azure Speech Synthesis Failed",
-                "details": f"Speech synthesis API call failed: {str(e)}",
-                "api": "Azure Speech Synthesis (Synthesis)"
-            }), 500
-        # Check synthesis result and retrieve audio and timings
-        try:
-            logger.info("Processing Azure Speech Synthesis results")
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                logger.info("Speech synthesis completed successfully, processing results")
-                # Separate viseme and word events
-                viseme_events = [e for e in events if e["type"] == "viseme"]
-                word_events = [e for e in events if e["type"] == "word"]
-                bookmark_events = [e for e in events if e["type"] == "bookmark"]
-
-                # Format phoneme_timings (viseme timings)
-                phoneme_timings = [
-                    {
-                        "time": e["time"] / 1000,    # Convert ms to seconds
-                        "viseme": e["value"]         # Azure viseme ID (integer)
-                    } for e in viseme_events
-                ]
-                word_timings = [
-                    {
-                        "time": e["time"] / 1000,    # Convert ms to seconds
-                        "word": e["word"]         # Azure viseme ID (integer)
-                    } for e in word_events
-                ]
-                bookmark_timings = [
-                    {
-                        "time": event["time"] / 1000,  # Convert milliseconds to seconds
-                        "mark": event["mark"]          # The bookmark name (e.g., "Head-Tilt")
-                    }
-                    for event in bookmark_events
-                ]
-
-                audio_data = result.audio_data  # Binary audio data
-                audio_base64 = base64.b64encode(audio_data).decode('utf-8')# Convert audio data to base64 string
-
-                logger.info("Successfully processed all synthesis results")
-                return jsonify({
-                    "audio_url": audio_base64,
-                    "ai_response": textValue,
-                    "phoneme_timings": phoneme_timings,
-                    "word_timings": word_timings,
-                    "bookmark_timings": bookmark_timings,
-                    "splitContext": segments,
-                    "style": style,
-                })
-            else:
-                # Return error if synthesis fails
-                logger.error(f"Azure Speech Synthesis failed with reason: {result.reason}")
-                error_message = f"Synthesis failed with reason: {result.reason}"
-                if result.reason == speechsdk.ResultReason.Canceled:
-                    cancellation_details = speechsdk.SpeechSynthesisCancellationDetails(result)
-                    error_message += f", ErrorCode: {cancellation_details.error_code}, Details: {cancellation_details.error_details}"
-                    logger.error(f"Synthesis cancellation details: {cancellation_details.error_details}")
-                return jsonify({
-                    "error": "Azure Speech Synthesis Failed",
-                    "details": error_message,
-                    "api": "Azure Speech Synthesis (Result Processing)"
-                }), 500
+            if animation_fps:
+                # Blendshape keyframe tracks compiled from the same timeline, ready to play at a fixed rate
+                with metrics.Stage("animation_curves", g.timings):
+                    curves = animation_curves.compile_curves(
+                        synthesis["timeline"], synthesis["audio_duration"], animation_fps)
+            with metrics.Stage("encode", g.timings):
+                reply = build_reply(options, textValue, synthesis, segments, style,
+                                    curves if animation_fps else None, script_job)
+                response = jsonify(reply)
+            logger.info("Successfully processed all synthesis results")
+            return response
         except Exception as e:
             logger.error(f"Failed to process Azure Speech Synthesis results: {str(e)}")
             return jsonify({
@@ -592,6 +1279,142 @@ def respond():
             "api": "General Error Handler"
         }), 500
 
+@app.route("/api/respond/batch", methods=["POST"])
+@admission.admit(request_priority)
+def respond_batch():
+    """Run many /api/respond requests at once, streaming each result as NDJSON as soon as it's ready."""
+    try:
+        logger.info("Received request to /api/respond/batch")
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Invalid Request", "details": "No JSON data provided", "api": "Request Parsing"}), 400
+        entries = data.get("items")
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"error": "Invalid Request", "details": "items must be a non-empty list", "api": "Request Parsing"}), 400
+        if len(entries) > BATCH_MAX_ITEMS:
+            return jsonify({"error": "Invalid Request", "details": f"A batch holds at most {BATCH_MAX_ITEMS} items", "api": "Request Parsing"}), 400
+
+        # Top-level options apply to every item; an item is a message or an object overriding them
+        shared = {name: value for name, value in data.items() if name not in ("items", "stream")}
+        items = {}  # dedupe key -> (options, indexes)
+        invalid = {}
+        for index, entry in enumerate(entries):
+            entry = {"message": entry} if isinstance(entry, str) else entry
+            if not isinstance(entry, dict):
+                invalid[index] = "Each item must be a message string or an object"
+                continue
+            options, details = parse_respond_options({**shared, **entry})
+            if details:
+                invalid[index] = details
+                continue
+            # Identical items (same message and options) are generated and synthesized once
+            key = json.dumps(options, sort_keys=True)
+            items.setdefault(key, (options, []))[1].append(index)
+        logger.info(f"Processing batch of {len(entries)} items ({len(items)} distinct, {len(invalid)} invalid)")
+
+        events = stream_batch(client_pool.get_gemini_client(), items, invalid)
+        return Response(stream_with_context(metrics.count_stream(events, "respond_batch")),
+                        mimetype="application/x-ndjson")
+    except Exception as e:
+        logger.error(f"Unexpected error in /api/respond/batch endpoint: {str(e)}")
+        return jsonify({
+            "error": "Internal Server Error",
+            "details": f"An unexpected error occurred: {str(e)}",
+            "api": "General Error Handler"
+        }), 500
+
+@app.route("/api/audio/<artifact_id>", methods=["GET"])
+def get_audio(artifact_id):
+    artifact = audio_store.lookup(artifact_id)
+    if artifact is None:
+        abort(404)
+    path, mimetype = artifact
+    # send_file streams through the server's file wrapper (sendfile) and answers Range/If-None-Match requests
+    return send_file(path, mimetype=mimetype, conditional=True, etag=artifact_id,
+                     max_age=int(audio_store.AUDIO_STORE_TTL))
+
+@app.route("/api/filler", methods=["GET"])
+def get_filler():
+    # Served from the in-memory bank, with no upstream call, so it isn't held back by admission control
+    personality = request.args.get("personality", "cheerful")
+    degree = request.args.get("styledegree", "1")
+    audioFormat = request.args.get("audioFormat", audio_formats.DEFAULT_AUDIO_FORMAT)
+    timingFormat = request.args.get("timingFormat", "objects")
+    if audioFormat not in audio_formats.OUTPUT_FORMATS:
+        return jsonify({"error": "Invalid Request", "details": f"audioFormat must be one of {', '.join(audio_formats.OUTPUT_FORMATS)}",
+                        "api": "Request Parsing"}), 400
+    if timingFormat not in TIMING_FORMATS:
+        return jsonify({"error": "Invalid Request", "details": f"timingFormat must be one of {', '.join(TIMING_FORMATS)}",
+                        "api": "Request Parsing"}), 400
+    filler = fillers.get(personality, degree, audioFormat)
+    if filler is None:
+        return jsonify({"error": "Not Found", "details": f"No {audioFormat} filler for personality {personality}",
+                        "api": "Filler Bank"}), 404
+    return jsonify(filler.to_dict(audioFormat, timingFormat))
+
+def script_job_url(job_id):
+    return url_for("get_script_context", job_id=job_id, _external=True)
+
+@app.route("/api/script-context/<job_id>", methods=["GET"])
+def get_script_context(job_id):
+    record = script_jobs.lookup(job_id)
+    if record is None:
+        return jsonify({"error": "Not Found", "details": "Unknown or expired script context job",
+                        "api": "Script Context Jobs"}), 404
+    if record["status"] == "failed":
+        return jsonify(record), 500
+    # 202 until the job is done, then the same splitContext/style fields as /api/respond
+    return jsonify(record), 200 if record["status"] == "done" else 202
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    # Per-worker counters used to size pools and caches for each gunicorn worker
+    return jsonify({"pid": os.getpid(), **client_pool.stats(), "tts_cache": tts_cache.stats(),
+                    "gemini_cache": generation_cache.stats(),
+                    "script_context_jobs": script_jobs.stats(),
+                    "upstream": upstream.stats(),
+                    "admission": admission.stats(),
+                    "fillers": fillers.stats(),
+                    "sessions": sessions.stats(),
+                    "prompts": prompts.stats(),
+                    "startup": {"app_import_ms": round(APP_IMPORT_SECONDS * 1000, 1),
+                                "provider_imports_ms": client_pool.import_stats(),
+                                "warm_up_ms": round(_warm_up_seconds * 1000, 1) if _warm_up_seconds is not None else None}})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+_warm_up_seconds = None
+
+
+def warm_up():
+    """Get this worker ready for its first request: provider clients, the upstream loop, SYNTHESIZER_PREWARM
+    open synthesizer connections, and prompt token counting/caching and the filler bank started in the
+    background.
+
+    Run by gunicorn's post_worker_init hook (gunicorn.conf.py) and before the development server starts.
+    Failures are only logged, the first request then sets up whatever is missing and reports the error.
+    """
+    global _warm_up_seconds
+    start = time.perf_counter()
+    try:
+        client = client_pool.get_gemini_client()
+        client_pool.get_event_loop().call_soon_threadsafe(prompts.maintain, client, GEMINI_MODEL)
+        default_format = audio_formats.OUTPUT_FORMATS[audio_formats.DEFAULT_AUDIO_FORMAT]
+        client_pool.get_synthesizer_pool(default_format.sdk_name).prewarm(client_pool.SYNTHESIZER_PREWARM)
+        fillers.start(synthesize_ssml_pipelined)
+    except Exception as e:
+        logger.error(f"Worker warm-up failed: {str(e)}")
+    _warm_up_seconds = time.perf_counter() - start
+    logger.info(f"Worker {os.getpid()} warmed up in {_warm_up_seconds * 1000:.1f} ms")
+
+
+# Provider SDKs are not part of this, see client_pool.load_providers
+APP_IMPORT_SECONDS = time.perf_counter() - _import_started
+logger.info(f"App imported in {APP_IMPORT_SECONDS * 1000:.1f} ms")
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # Use Render's PORT env var
+    warm_up()
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,86 @@
+"""Synthesis output formats and helpers for stitching separately synthesized pieces into one reply."""
+import os
+import struct
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# sdk_name: azure.cognitiveservices.speech.SpeechSynthesisOutputFormat member used in speech_config
+# concatenable: whole files can be joined back-to-back (RIFF is re-headered, MP3 frames and raw PCM are
+# self-delimiting); Ogg/WebM containers can't, so those replies are synthesized in a single call
+AudioFormat = namedtuple("AudioFormat", ["sdk_name", "extension", "mime_type", "concatenable"])
+
+OUTPUT_FORMATS = {
+    "wav": AudioFormat("Riff16Khz16BitMonoPcm", "wav", "audio/wav", True),
+    "wav-24khz": AudioFormat("Riff24Khz16BitMonoPcm", "wav", "audio/wav", True),
+    "pcm": AudioFormat("Raw16Khz16BitMonoPcm", "pcm", "audio/L16;rate=16000;channels=1", True),
+    "mp3-32k": AudioFormat("Audio16Khz32KBitRateMonoMp3", "mp3", "audio/mpeg", True),
+    "mp3-64k": AudioFormat("Audio16Khz64KBitRateMonoMp3", "mp3", "audio/mpeg", True),
+    "mp3-128k": AudioFormat("Audio16Khz128KBitRateMonoMp3", "mp3", "audio/mpeg", True),
+    "mp3-48k-24khz": AudioFormat("Audio24Khz48KBitRateMonoMp3", "mp3", "audio/mpeg", True),
+    "mp3-96k-24khz": AudioFormat("Audio24Khz96KBitRateMonoMp3", "mp3", "audio/mpeg", True),
+    "opus": AudioFormat("Ogg24Khz16BitMonoOpus", "ogg", "audio/ogg", False),
+    "opus-16khz": AudioFormat("Ogg16Khz16BitMonoOpus", "ogg", "audio/ogg", False),
+    "webm-opus": AudioFormat("Webm24Khz16BitMonoOpus", "webm", "audio/webm", False),
+}
+
+# The SDK's own default is 16 kHz RIFF PCM, so "wav" keeps today's responses unchanged
+DEFAULT_AUDIO_FORMAT = os.environ.get("AUDIO_FORMAT", "wav")
+if DEFAULT_AUDIO_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(f"AUDIO_FORMAT must be one of {', '.join(OUTPUT_FORMATS)}")
+
+# File extension -> mime type for serving stored audio
+MIME_TYPES = {f.extension: f.mime_type for f in OUTPUT_FORMATS.values()}
+
+
+def _riff_chunks(audio):
+    # Yields (chunk id, body offset, body length) for each chunk of a RIFF/WAVE file
+    offset = 12
+    while offset + 8 <= len(audio):
+        chunk_id, size = struct.unpack_from("<4sI", audio, offset)
+        body = offset + 8
+        if chunk_id == b"data" and (size == 0 or size == 0xFFFFFFFF or body + size > len(audio)):
+            size = len(audio) - body  # streaming writers leave the data size unset
+        yield chunk_id, body, size
+        offset = body + size + (size & 1)
+
+
+def is_riff(audio):
+    return len(audio) >= 12 and audio[:4] == b"RIFF" and audio[8:12] == b"WAVE"
+
+
+def riff_duration(audio):
+    """Duration in seconds of a PCM RIFF/WAVE file, or None if it can't be determined."""
+    if not is_riff(audio):
+        return None
+    byte_rate = None
+    for chunk_id, body, size in _riff_chunks(audio):
+        if chunk_id == b"fmt " and size >= 12:
+            byte_rate = struct.unpack_from("<I", audio, body + 8)[0]
+        elif chunk_id == b"data" and byte_rate:
+            return size / byte_rate
+    return None
+
+
+def concat_audio(parts):
+    """Concatenate complete audio files of one output format into a single file.
+
+    RIFF/WAVE files are merged into one header plus the joined sample data. Raw PCM and MP3 streams
+    are concatenated as-is.
+    """
+    if len(parts) == 1:
+        return bytes(parts[0])
+    if not all(is_riff(part) for part in parts):
+        return b"".join(parts)
+    fmt = None
+    samples = []
+    for part in parts:
+        for chunk_id, body, size in _riff_chunks(part):
+            if chunk_id == b"fmt " and fmt is None:
+                fmt = bytes(part[body:body + size])
+            elif chunk_id == b"data":
+                samples.append(part[body:body + size])
+    data = b"".join(samples)
+    header = b"WAVE" + struct.pack("<4sI", b"fmt ", len(fmt)) + fmt + struct.pack("<4sI", b"data", len(data))
+    return b"RIFF" + struct.pack("<I", len(header) + len(data)) + header + data
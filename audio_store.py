@@ -0,0 +1,101 @@
+"""File-backed store for synthesized audio served from /api/audio/<id>.
+
+Instead of base64-encoding the audio into the JSON body, /api/respond can write it here and return
+a URL. Artifacts are content-addressed (the id is the SHA-256 of the audio, which doubles as the
+ETag), live in a directory shared by every worker on the host and are removed by a background
+sweeper once they are older than AUDIO_STORE_TTL.
+"""
+import os
+import re
+import hashlib
+import tempfile
+import threading
+import time
+import logging
+from audio_formats import MIME_TYPES
+
+logger = logging.getLogger(__name__)
+
+AUDIO_DELIVERY_MODES = ("base64", "url")
+AUDIO_DELIVERY_DEFAULT = os.environ.get("AUDIO_DELIVERY", "base64")  # server default when a request doesn't choose
+AUDIO_STORE_DIR = os.environ.get("AUDIO_STORE_DIR") or os.path.join(tempfile.gettempdir(), "ai-anime-dating-audio")
+AUDIO_STORE_TTL = float(os.environ.get("AUDIO_STORE_TTL", 3600))  # seconds an artifact stays downloadable
+AUDIO_STORE_SWEEP_INTERVAL = float(os.environ.get("AUDIO_STORE_SWEEP_INTERVAL", 300))  # seconds
+
+_ARTIFACT_ID = re.compile(r"^[0-9a-f]{64}$")
+_sweeper_lock = threading.Lock()
+_sweeper_pid = None
+
+
+def _path(artifact_id, extension):
+    return os.path.join(AUDIO_STORE_DIR, f"{artifact_id}.{extension}")
+
+
+def put(audio_data, extension="wav"):
+    """Store audio and return its artifact id."""
+    _ensure_sweeper()
+    artifact_id = hashlib.sha256(audio_data).hexdigest()
+    path = _path(artifact_id, extension)
+    if os.path.exists(path):
+        os.utime(path)  # identical audio is already stored, just restart its expiry
+        return artifact_id
+    os.makedirs(AUDIO_STORE_DIR, exist_ok=True)
+    # Write to a temp file and rename so a concurrent download never sees a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=AUDIO_STORE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(audio_data)
+    os.replace(tmp_path, path)
+    logger.info(f"Stored audio artifact {artifact_id} ({len(audio_data)} bytes)")
+    return artifact_id
+
+
+def lookup(artifact_id):
+    """Return (path, mimetype) of a live artifact, or None if it is unknown or expired."""
+    if not _ARTIFACT_ID.match(artifact_id):
+        return None
+    for extension, mimetype in MIME_TYPES.items():
+        path = _path(artifact_id, extension)
+        try:
+            if os.stat(path).st_mtime + AUDIO_STORE_TTL > time.time():
+                return path, mimetype
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def sweep(now=None):
+    now = time.time() if now is None else now
+    removed = 0
+    try:
+        entries = list(os.scandir(AUDIO_STORE_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime + AUDIO_STORE_TTL <= now:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} expired audio artifacts")
+    return removed
+
+
+def _sweep_forever():
+    while True:
+        time.sleep(AUDIO_STORE_SWEEP_INTERVAL)
+        try:
+            sweep()
+        except Exception as e:
+            logger.error(f"Audio artifact sweep failed: {str(e)}")
+
+
+def _ensure_sweeper():
+    # One sweeper thread per worker process, started lazily so it is never lost across a fork
+    global _sweeper_pid
+    with _sweeper_lock:
+        if _sweeper_pid == os.getpid():
+            return
+        _sweeper_pid = os.getpid()
+        threading.Thread(target=_sweep_forever, name="audio-store-sweeper", daemon=True).start()
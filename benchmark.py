@@ -0,0 +1,260 @@
+"""Offline load test for /api/respond against fake Gemini and Azure providers.
+
+Starts the app (Flask's threaded server or gunicorn) with benchmark_fakes installed, drives
+/api/respond at each requested concurrency level and writes latency percentiles, throughput and
+memory figures to a JSON file, so results of successive versions can be compared:
+
+    python benchmark.py --server gunicorn --workers 2 --threads 8 --concurrency 1,4,16 --requests 200
+    python benchmark.py --stream --payload '{"getScriptContext": false, "audioFormat": "mp3-32k"}'
+
+Fake provider latencies and reply sizes are set with the BENCH_* variables documented in benchmark_fakes.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import uuid
+import itertools
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, port):
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    if args.server == "gunicorn":
+        command = ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+                   "--threads", str(args.threads), "--log-level", "warning", "benchmark_fakes:create_app()"]
+    else:
+        command = [sys.executable, "benchmark_fakes.py", "--port", str(port)]
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{args.server} exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/api/stats")
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{args.server} did not start listening on port {port}")
+
+
+class Client:
+    """One keep-alive connection issuing /api/respond requests and timing them."""
+
+    def __init__(self, port, timeout):
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+            start = time.perf_counter()
+            try:
+                self.connection.request("POST", "/api/respond", body=body, headers=headers)
+                response = self.connection.getresponse()
+                first_byte = None
+                size = 0
+                while True:
+                    chunk = response.read1(65536) if hasattr(response, "read1") else response.read(65536)
+                    if not chunk:
+                        break
+                    if first_byte is None:
+                        first_byte = time.perf_counter()
+                    size += len(chunk)
+                end = time.perf_counter()
+                if response.getheader("Connection", "").lower() == "close":
+                    self.close()
+                return {
+                    "status": response.status,
+                    "latency_ms": (end - start) * 1000,
+                    "ttfb_ms": ((first_byte or end) - start) * 1000,
+                    "bytes": size,
+                    "peak_bytes": response.getheader("X-Bench-Peak-Bytes"),
+                    "max_rss": response.getheader("X-Bench-Max-RSS"),
+                }
+            except (http.client.HTTPException, OSError) as e:
+                # A keep-alive connection closed by the server is retried once on a fresh one
+                self.close()
+                if attempt:
+                    return {"status": None, "error": str(e), "latency_ms": (time.perf_counter() - start) * 1000}
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def payloads(base, distinct, tag):
+    # Unique messages defeat the Gemini and TTS caches (the disk tier outlives the server, so the tag
+    # includes a per-run id); --distinct-messages N cycles N messages within each level instead
+    for i in itertools.count():
+        n = i % distinct if distinct else i
+        yield {**base, "message": f"{base['message']} #{tag}-{n}"}
+
+
+def run_level(port, concurrency, total, base, args):
+    source = zip(range(total), payloads(base, args.distinct_messages, f"{args.run_id}-c{concurrency}"))
+    lock = threading.Lock()
+    results = []
+
+    def worker():
+        client = Client(port, args.timeout)
+        try:
+            while True:
+                with lock:
+                    item = next(source, None)
+                if item is None:
+                    return
+                result = client.request(item[1])
+                with lock:
+                    results.append(result)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "duration_s": round(elapsed, 3),
+        "requests_per_second": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize([r["latency_ms"] for r in ok]),
+        "ttfb_ms": summarize([r["ttfb_ms"] for r in ok]),
+        "response_bytes": summarize([r["bytes"] for r in ok]),
+        "max_rss_bytes": max((int(r["max_rss"]) for r in ok if r.get("max_rss")), default=None),
+    }
+
+
+def measure_memory(port, samples, base, args):
+    # tracemalloc is global to the worker, so traced requests are sent one at a time
+    client = Client(port, args.timeout)
+    peaks = []
+    for payload in itertools.islice(payloads(base, 0, f"{args.run_id}-memory"), samples):
+        result = client.request(payload, headers={"X-Bench-Trace-Memory": "1"})
+        if result["status"] == 200 and result.get("peak_bytes"):
+            peaks.append(int(result["peak_bytes"]))
+    client.close()
+    return {"samples": len(peaks), "per_request_peak_bytes": summarize(peaks)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--server", choices=("flask", "gunicorn"), default="flask")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=4, help="untimed requests before the first level")
+    parser.add_argument("--memory-samples", type=int, default=10, help="sequential traced requests (0 skips)")
+    parser.add_argument("--distinct-messages", type=int, default=0, help="cycle N messages (0: every message unique)")
+    parser.add_argument("--payload", default="{}", help="JSON merged into every /api/respond request body")
+    parser.add_argument("--stream", action="store_true", help="use NDJSON streaming responses")
+    parser.add_argument("--timeout", type=float, default=120, help="per-request client timeout in seconds")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--server-log", help="file receiving the server's output")
+    args = parser.parse_args()
+    args.run_id = uuid.uuid4().hex[:8]
+
+    base = {"message": "How is your day going?", **json.loads(args.payload)}
+    if args.stream:
+        base["stream"] = True
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    port = free_port()
+    server = start_server(args, port)
+    try:
+        warmup = Client(port, args.timeout)
+        for payload in itertools.islice(payloads(base, 0, f"{args.run_id}-warmup"), args.warmup):
+            warmup.request(payload)
+        warmup.close()
+        results = []
+        for concurrency in levels:
+            level = run_level(port, concurrency, args.requests, base, args)
+            results.append(level)
+            latency = level["latency_ms"] or {}
+            print(f"concurrency {concurrency:>4}: {level['requests_per_second']} req/s, "
+                  f"p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, "
+                  f"{level['errors']} errors")
+        memory = measure_memory(port, args.memory_samples, base, args) if args.memory_samples else None
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "config": {
+            **{name: value for name, value in vars(args).items() if name not in ("output", "server_log")},
+            "fakes": {name: value for name, value in os.environ.items() if name.startswith("BENCH_")},
+        },
+        "results": results,
+        "memory": memory,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if memory and memory["per_request_peak_bytes"]:
+        print(f"per-request peak memory: p50 {memory['per_request_peak_bytes']['p50'] / 1024:.0f} KiB, "
+              f"max {memory['per_request_peak_bytes']['max'] / 1024:.0f} KiB")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
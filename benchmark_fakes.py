@@ -0,0 +1,346 @@
+"""Offline stand-ins for the Gemini and Azure Speech SDK clients, used by benchmark.py.
+
+install() swaps client_pool's genai.Client and speechsdk.SpeechSynthesizer/Connection/SpeechConfig for
+fakes with configurable latency distributions and reply sizes. The fake synthesizer fires the same
+synthesizing/viseme/word/bookmark/completed callbacks on its own thread as the real SDK, paced by a real-time
+factor, so pooling, pipelining, streaming and timeline code all run unchanged. Configuration comes from
+BENCH_* environment variables so gunicorn workers built with create_app() pick it up too.
+
+Latency specs are "fixed:MS", "uniform:LO_MS,HI_MS", "normal:MEAN_MS,SD_MS" or "lognormal:MEDIAN_MS,SIGMA".
+BENCH_GEMINI_ERRORS injects upstream errors as "STATUS:FRACTION" pairs, e.g. "429:0.05,503:0.02".
+"""
+import os
+import re
+import asyncio
+import json
+import math
+import random
+import struct
+import hashlib
+import resource
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from types import SimpleNamespace
+import azure.cognitiveservices.speech as speechsdk
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
+
+BENCH_GEMINI_LATENCY = os.environ.get("BENCH_GEMINI_LATENCY", "lognormal:700,0.35")  # per generate_content call
+BENCH_GEMINI_ERRORS = os.environ.get("BENCH_GEMINI_ERRORS", "")  # e.g. "429:0.05,503:0.02"
+BENCH_AZURE_CONNECT_LATENCY = os.environ.get("BENCH_AZURE_CONNECT_LATENCY", "lognormal:180,0.3")  # per connection open
+BENCH_AZURE_FIRST_BYTE_LATENCY = os.environ.get("BENCH_AZURE_FIRST_BYTE_LATENCY", "lognormal:250,0.3")
+BENCH_AZURE_RTF = float(os.environ.get("BENCH_AZURE_RTF", 0.15))  # wall seconds per second of audio after the first byte
+BENCH_REPLY_SENTENCES = int(os.environ.get("BENCH_REPLY_SENTENCES", 4))  # sentences in each SSML reply
+BENCH_SEGMENTS = int(os.environ.get("BENCH_SEGMENTS", 8))  # splitContext segments
+
+WORD_SECONDS = 0.3  # spoken length of one fake word
+VISEMES_PER_WORD = 3
+CHUNK_SECONDS = 0.5  # audio delivered per "synthesizing" event
+TICKS_PER_SECOND = 10_000_000
+
+_WORDS = ("oh", "my", "day", "has", "been", "really", "great", "thanks", "for", "asking", "how", "about", "yours",
+          "anything", "exciting", "happen", "today", "I", "love", "that", "idea", "tell", "me", "more")
+_MARKS = ("Head-Tilt", "Brow-L-Raise", "Brow-R-Raise", "Pupils-X", "Pupils-Y", "Blink")
+
+
+def parse_latency(spec):
+    """Return a function sampling one latency in seconds from a latency spec."""
+    kind, _, args = spec.partition(":")
+    params = [float(arg) for arg in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda: params[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(params[0], params[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(params[0])
+        return lambda: random.lognormvariate(mu, params[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_errors(spec):
+    """Return a function raising a google.genai error with the configured probabilities, if any."""
+    rates = [(int(status), float(fraction)) for status, _, fraction in
+             (pair.partition(":") for pair in spec.split(",") if pair.strip())]
+
+    def maybe_fail():
+        draw = random.random()
+        for status, fraction in rates:
+            if draw < fraction:
+                error = genai_errors.ClientError if status < 500 else genai_errors.ServerError
+                raise error(status, {"error": {"code": status, "message": "Injected by benchmark_fakes", "status": "FAKE"}})
+            draw -= fraction
+    return maybe_fail
+
+
+def _rng(*parts):
+    # Deterministic per input, so identical requests still produce identical replies (and cache hits)
+    return random.Random(hashlib.sha256("\0".join(map(str, parts)).encode("utf-8")).digest())
+
+
+# Gemini
+
+
+def fake_ssml_reply(seed, sentences=BENCH_REPLY_SENTENCES):
+    rng = _rng("ssml", seed)
+    parts = []
+    for _ in range(sentences):
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 14)))
+        parts.append(f'{words.capitalize()}! <bookmark mark="{rng.choice(_MARKS)}"/>')
+    return "<speak>" + ' <break time="300ms"/> '.join(parts) + "</speak>"
+
+
+def fake_split_context(seed, segments=BENCH_SEGMENTS):
+    rng = _rng("context", seed)
+    return json.dumps({
+        "segments": [{
+            "text": " ".join(rng.choice(_WORDS) for _ in range(8)),
+            "visual_representation_of_text": " ".join(rng.choice(_WORDS) for _ in range(20)),
+            "style_modifier": "soft pastel lighting",
+        } for _ in range(segments)],
+        "script_scene_style": "anime_style",
+    })
+
+
+class FakeAsyncModels:
+    def __init__(self, latency, maybe_fail):
+        self._latency = latency
+        self._maybe_fail = maybe_fail
+
+    async def generate_content(self, model, config=None, contents=None):
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        seed = "\n".join(map(str, contents or []))
+        system_instruction = getattr(config, "system_instruction", "") or ""
+        if "Segmentation" in system_instruction:  # the split-context prompt, every other prompt asks for SSML
+            return SimpleNamespace(text=fake_split_context(seed))
+        return SimpleNamespace(text=fake_ssml_reply(seed))
+
+    async def count_tokens(self, model, contents=None, config=None):
+        return SimpleNamespace(total_tokens=sum(len(str(part)) for part in contents or []) // 4)
+
+
+class FakeGenaiClient:
+    def __init__(self, api_key=None, **kwargs):
+        latency = parse_latency(BENCH_GEMINI_LATENCY)
+        maybe_fail = parse_errors(BENCH_GEMINI_ERRORS)
+        # The app only uses the async API (client.aio)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(latency, maybe_fail))
+
+
+# Azure Speech
+
+
+class FakeEventSignal:
+    def __init__(self):
+        self._callbacks = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def disconnect_all(self):
+        self._callbacks = []
+
+    def fire(self, evt):
+        for callback in list(self._callbacks):
+            callback(evt)
+
+
+class FakeSpeechConfig:
+    def __init__(self, subscription=None, region=None):
+        self.speech_synthesis_voice_name = None
+        self.output_format = speechsdk.SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm
+
+    def set_speech_synthesis_output_format(self, output_format):
+        self.output_format = output_format
+
+
+class FakeConnection:
+    _latency = None
+
+    def __init__(self, synthesizer):
+        self.synthesizer = synthesizer
+
+    @classmethod
+    def from_speech_synthesizer(cls, synthesizer):
+        return cls(synthesizer)
+
+    def open(self, for_continuous_recognition):
+        time.sleep(FakeConnection._latency())
+
+    def close(self):
+        pass
+
+
+class _FakeResultFuture:
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+
+    def set(self, result):
+        self._result = result
+        self._done.set()
+
+    def get(self):
+        self._done.wait()
+        return self._result
+
+
+_TOKEN = re.compile(r'<bookmark\s+mark="([^"]*)"\s*/>|<[^>]*>|([^<\s]+)')
+
+
+def _audio_bytes(output_format, seconds):
+    name = getattr(output_format, "name", str(output_format))
+    rate = int(re.search(r"(\d+)Khz", name).group(1)) * 1000 if "Khz" in name else 16000
+    if name.startswith("Riff") or name.startswith("Raw"):
+        data = bytes(int(seconds * rate) * 2)  # 16-bit mono silence
+        if name.startswith("Raw"):
+            return data
+        fmt = struct.pack("<HHIIHH", 1, 1, rate, rate * 2, 2, 16)
+        header = b"WAVE" + struct.pack("<4sI", b"fmt ", len(fmt)) + fmt + struct.pack("<4sI", b"data", len(data))
+        return b"RIFF" + struct.pack("<I", len(header) + len(data)) + header + data
+    bitrate = int(re.search(r"(\d+)KBitRate", name).group(1)) * 1000 if "KBitRate" in name else 32000
+    return bytes(int(seconds * bitrate / 8))
+
+
+class FakeSpeechSynthesizer:
+    _first_byte_latency = None
+
+    def __init__(self, speech_config=None, audio_config=None):
+        self.speech_config = speech_config
+        self.synthesizing = FakeEventSignal()
+        self.viseme_received = FakeEventSignal()
+        self.synthesis_word_boundary = FakeEventSignal()
+        self.bookmark_reached = FakeEventSignal()
+        self.synthesis_completed = FakeEventSignal()
+        self.synthesis_canceled = FakeEventSignal()
+        self._stopped = threading.Event()
+
+    def speak_ssml_async(self, ssml):
+        self._stopped.clear()
+        future = _FakeResultFuture()
+        threading.Thread(target=self._synthesize, args=(ssml, future), daemon=True).start()
+        return future
+
+    def stop_speaking_async(self):
+        self._stopped.set()
+        future = _FakeResultFuture()
+        future.set(None)
+        return future
+
+    def _synthesize(self, ssml, future):
+        # Lay out word, viseme and bookmark events on the audio timeline
+        events = []
+        offset = 0.0
+        for mark, word in _TOKEN.findall(ssml):
+            if mark:
+                events.append((offset, "bookmark", SimpleNamespace(audio_offset=int(offset * TICKS_PER_SECOND), text=mark)))
+            elif word:
+                events.append((offset, "word", SimpleNamespace(audio_offset=int(offset * TICKS_PER_SECOND), text=word)))
+                for i in range(VISEMES_PER_WORD):
+                    at = offset + i * WORD_SECONDS / VISEMES_PER_WORD
+                    viseme_id = (ord(word[i % len(word)]) % 21) + 1
+                    events.append((at, "viseme", SimpleNamespace(audio_offset=int(at * TICKS_PER_SECOND), viseme_id=viseme_id)))
+                offset += WORD_SECONDS
+        duration = offset
+        audio = _audio_bytes(self.speech_config.output_format, duration)
+
+        time.sleep(FakeSpeechSynthesizer._first_byte_latency())
+        signals = {"bookmark": self.bookmark_reached, "word": self.synthesis_word_boundary, "viseme": self.viseme_received}
+        chunks = max(1, math.ceil(duration / CHUNK_SECONDS))
+        chunk_bytes = math.ceil(len(audio) / chunks)
+        next_event = 0
+        for chunk in range(chunks):
+            if self._stopped.is_set():
+                result = SimpleNamespace(reason=speechsdk.ResultReason.Canceled, audio_data=b"", audio_duration=None)
+                self.synthesis_canceled.fire(SimpleNamespace(result=result))
+                future.set(result)
+                return
+            end = (chunk + 1) * CHUNK_SECONDS
+            while next_event < len(events) and (events[next_event][0] < end or chunk == chunks - 1):
+                _, kind, evt = events[next_event]
+                signals[kind].fire(evt)
+                next_event += 1
+            piece = audio[chunk * chunk_bytes:(chunk + 1) * chunk_bytes]
+            self.synthesizing.fire(SimpleNamespace(result=SimpleNamespace(audio_data=piece)))
+            time.sleep(CHUNK_SECONDS * BENCH_AZURE_RTF)
+        result = SimpleNamespace(reason=speechsdk.ResultReason.SynthesizingAudioCompleted, audio_data=audio,
+                                 audio_duration=timedelta(seconds=duration))
+        self.synthesis_completed.fire(SimpleNamespace(result=result))
+        future.set(result)
+
+
+def install():
+    """Point client_pool at the fakes. Must run before the first request builds any client."""
+    import client_pool
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("AZURE_API_KEY", "benchmark")
+    FakeConnection._latency = parse_latency(BENCH_AZURE_CONNECT_LATENCY)
+    FakeSpeechSynthesizer._first_byte_latency = parse_latency(BENCH_AZURE_FIRST_BYTE_LATENCY)
+    client_pool.genai = SimpleNamespace(Client=FakeGenaiClient, types=genai_types)
+    client_pool.speechsdk = SimpleNamespace(
+        SpeechConfig=FakeSpeechConfig,
+        SpeechSynthesizer=FakeSpeechSynthesizer,
+        Connection=FakeConnection,
+        SpeechSynthesisOutputFormat=speechsdk.SpeechSynthesisOutputFormat,
+        ResultReason=speechsdk.ResultReason,
+        SpeechSynthesisCancellationDetails=speechsdk.SpeechSynthesisCancellationDetails,
+    )
+
+
+def _max_rss():
+    return str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)  # ru_maxrss is in KiB on Linux
+
+
+class MemoryProbe:
+    """WSGI middleware reporting memory to the benchmark in response headers.
+
+    Every response carries the worker's peak RSS. Requests sent with X-Bench-Trace-Memory: 1 are run
+    under tracemalloc (which is slow, so the benchmark sends them one at a time) and also report
+    the peak bytes Python allocated while handling them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get("HTTP_X_BENCH_TRACE_MEMORY") != "1":
+            def start(status, headers, exc_info=None):
+                headers.append(("X-Bench-Max-RSS", _max_rss()))
+                return start_response(status, headers, exc_info)
+            return self.app(environ, start)
+
+        # Traced requests are buffered so the peak covers producing the whole body
+        tracemalloc.start()
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured["status"], captured["headers"] = status, headers
+            return lambda data: None
+
+        body = b"".join(self.app(environ, capture))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        headers = [(name, value) for name, value in captured["headers"] if name.lower() != "content-length"]
+        headers += [("Content-Length", str(len(body))), ("X-Bench-Peak-Bytes", str(peak)), ("X-Bench-Max-RSS", _max_rss())]
+        start_response(captured["status"], headers)
+        return [body]
+
+
+def create_app():
+    """App factory for gunicorn: gunicorn "benchmark_fakes:create_app()"."""
+    install()
+    import app
+    app.app.wsgi_app = MemoryProbe(app.app.wsgi_app)
+    return app.app
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve the app on Flask's threaded dev server with fake providers")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    create_app().run(host="127.0.0.1", port=args.port, threaded=True)
@@ -0,0 +1,297 @@
+"""Process-wide provider clients.
+
+Each gunicorn worker builds one Gemini client, one Azure SpeechConfig and a small pool of
+pre-connected SpeechSynthesizers the first time they are needed, instead of paying TLS and
+websocket setup to both providers on every request. Upstream calls run as coroutines on one event
+loop per worker (get_event_loop/submit), so a waiting conversation costs a suspended coroutine
+rather than a thread. Everything is keyed to the owning process id, so state inherited across a
+fork is discarded and rebuilt in the child.
+
+The provider SDKs themselves are the bulk of the boot time and are only imported by load_providers(),
+on first use or from gunicorn's preload in the master, where forked workers share them copy-on-write.
+"""
+import os
+import asyncio
+import importlib
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+genai = None  # google.genai, imported by load_providers()
+speechsdk = None  # azure.cognitiveservices.speech, likewise
+
+AZURE_REGION = "canadacentral"
+AZURE_VOICE_NAME = "en-US-AriaNeural"
+DEFAULT_OUTPUT_FORMAT = "Riff16Khz16BitMonoPcm"  # the SDK's default synthesis output format
+
+# Synthesizers per worker and audio format, opened on demand. Every synthesis (and every piece of a pipelined
+# one) holds one, so this caps a worker's concurrent syntheses; the default matches AZURE_MAX_CONCURRENCY
+SYNTHESIZER_POOL_SIZE = int(os.environ.get("SYNTHESIZER_POOL_SIZE", 32))
+SYNTHESIZER_CHECKOUT_TIMEOUT = float(os.environ.get("SYNTHESIZER_CHECKOUT_TIMEOUT", 10))  # seconds
+SYNTHESIZER_PREWARM = int(os.environ.get("SYNTHESIZER_PREWARM", 1))  # connections a worker opens at boot
+
+# Synthesizer events a request may subscribe to for the duration of one checkout
+SYNTHESIZER_EVENTS = ("viseme_received", "bookmark_reached", "synthesis_word_boundary", "synthesizing",
+                      "synthesis_completed", "synthesis_canceled")
+
+_lock = threading.Lock()
+_owner_pid = None
+_gemini_client = None
+_speech_configs = {}  # SpeechSynthesisOutputFormat name -> SpeechConfig
+_synthesizer_pools = {}  # SpeechSynthesisOutputFormat name -> SynthesizerPool
+_loop = None
+_import_lock = threading.Lock()
+_import_seconds = {}  # module -> seconds its import took, in this process or the master it was forked from
+
+
+def _timed_import(name):
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_seconds[name] = time.perf_counter() - start
+    logger.info(f"Imported {name} in {_import_seconds[name] * 1000:.1f} ms")
+    return module
+
+
+def load_providers():
+    """Import the Gemini and Azure SDKs unless already loaded (or replaced, as benchmark_fakes does)."""
+    global genai, speechsdk
+    with _import_lock:
+        if genai is None:
+            genai = _timed_import("google.genai")
+        if speechsdk is None:
+            speechsdk = _timed_import("azure.cognitiveservices.speech")
+
+
+def import_stats():
+    return {name: round(seconds * 1000, 1) for name, seconds in _import_seconds.items()}
+
+
+def _ensure_process():
+    # Called with _lock held. Clients and open connections must never be shared across a fork.
+    global _owner_pid, _gemini_client, _speech_configs, _synthesizer_pools, _loop
+    pid = os.getpid()
+    if _owner_pid != pid:
+        if _owner_pid is not None:
+            logger.info(f"Process {pid} forked from {_owner_pid}, discarding inherited provider clients")
+        _owner_pid = pid
+        _gemini_client = None
+        _speech_configs = {}
+        _synthesizer_pools = {}
+        _loop = None  # the loop's thread doesn't survive a fork
+
+
+def get_event_loop():
+    """This worker's event loop for upstream I/O, running on its own daemon thread."""
+    global _loop
+    with _lock:
+        _ensure_process()
+        if _loop is None:
+            logger.info("Starting process-wide upstream I/O event loop")
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="upstream-io", daemon=True).start()
+        return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the upstream loop and return a concurrent.futures.Future for its result.
+
+    Cancelling the returned future cancels the coroutine.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def get_gemini_client():
+    global _gemini_client
+    load_providers()
+    with _lock:
+        _ensure_process()
+        if _gemini_client is None:
+            logger.info("Initializing process-wide Gemini client")
+            _gemini_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+            logger.info("Successfully initialized Gemini client")
+        return _gemini_client
+
+
+def _build_speech_config(output_format):
+    subscription_key = os.environ.get("AZURE_API_KEY")
+    if not subscription_key:
+        raise ValueError("AZURE_API_KEY environment variable not set")
+    speech_config = speechsdk.SpeechConfig(subscription=subscription_key, region=AZURE_REGION)
+    speech_config.speech_synthesis_voice_name = AZURE_VOICE_NAME
+    speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, output_format))
+    return speech_config
+
+
+def get_speech_config(output_format=DEFAULT_OUTPUT_FORMAT):
+    load_providers()
+    with _lock:
+        _ensure_process()
+        speech_config = _speech_configs.get(output_format)
+        if speech_config is None:
+            logger.info(f"Initializing process-wide Azure speech configuration for {output_format}")
+            speech_config = _speech_configs[output_format] = _build_speech_config(output_format)
+        return speech_config
+
+
+def get_synthesizer_pool(output_format=DEFAULT_OUTPUT_FORMAT):
+    # A synthesizer's output format is fixed by its SpeechConfig, so each format has its own pool
+    speech_config = get_speech_config(output_format)
+    with _lock:
+        _ensure_process()
+        pool = _synthesizer_pools.get(output_format)
+        if pool is None:
+            pool = _synthesizer_pools[output_format] = SynthesizerPool(speech_config, SYNTHESIZER_POOL_SIZE)
+        return pool
+
+
+def stats():
+    with _lock:
+        pools = dict(_synthesizer_pools) if _owner_pid == os.getpid() else {}
+    return {"synthesizer_pools": {output_format: pool.stats() for output_format, pool in pools.items()}}
+
+
+class _PooledSynthesizer:
+    __slots__ = ("synthesizer", "connection")
+
+    def __init__(self, synthesizer, connection):
+        self.synthesizer = synthesizer
+        self.connection = connection
+
+
+class SynthesizerPool:
+    """Checkout/return pool of SpeechSynthesizers whose service connection is already open.
+
+    Handlers are attached for one checkout only and disconnected on release, so a returned
+    synthesizer never delivers events to a finished request.
+    """
+
+    def __init__(self, speech_config, size):
+        self._speech_config = speech_config
+        self._size = size
+        self._idle = queue.LifoQueue()  # most recently used first, its connection is the warmest
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = {}
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.discarded = 0
+        self.connect_count = 0
+        self.connect_seconds = 0.0
+
+    def _create(self):
+        start = time.perf_counter()
+        synthesizer = speechsdk.SpeechSynthesizer(speech_config=self._speech_config, audio_config=None)
+        # Open the websocket now so the first synthesis doesn't pay the handshake
+        connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+        connection.open(True)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.connect_count += 1
+            self.connect_seconds += elapsed
+        logger.info(f"Opened pooled Azure synthesizer connection in {elapsed * 1000:.1f} ms")
+        return _PooledSynthesizer(synthesizer, connection)
+
+    def prewarm(self, count=None):
+        count = self._size if count is None else min(count, self._size)
+        while True:
+            with self._lock:
+                if self._created >= count:
+                    return
+                self._created += 1
+            try:
+                self._idle.put(self._create())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+    def _take(self):
+        try:
+            pooled = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return pooled
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self._size
+            if can_create:
+                self._created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+        if can_create:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=SYNTHESIZER_CHECKOUT_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"No pooled synthesizer available within {SYNTHESIZER_CHECKOUT_TIMEOUT}s "
+                               f"(pool size {self._size})")
+
+    def acquire(self, handlers=None):
+        """Check out a synthesizer and connect the given {event name: callback} handlers to it."""
+        pooled = self._take()
+        for event_name, handler in (handlers or {}).items():
+            getattr(pooled.synthesizer, event_name).connect(handler)
+        with self._lock:
+            self._in_use[id(pooled.synthesizer)] = pooled
+        return pooled.synthesizer
+
+    async def acquire_async(self, handlers=None):
+        """acquire() for coroutines: connecting or waiting for a free synthesizer happens off the event loop."""
+        checkout = asyncio.get_running_loop().run_in_executor(None, self.acquire, handlers)
+        try:
+            return await asyncio.shield(checkout)
+        except asyncio.CancelledError:
+            # The checkout still completes on the executor thread, hand that synthesizer straight back
+            checkout.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or self.release(f.result()))
+            raise
+
+    def release(self, synthesizer, discard=False):
+        """Detach request handlers and return the synthesizer, or drop it if it is no longer healthy."""
+        with self._lock:
+            pooled = self._in_use.pop(id(synthesizer), None)
+        if pooled is None:
+            return
+        for event_name in SYNTHESIZER_EVENTS:
+            getattr(synthesizer, event_name).disconnect_all()
+        if discard:
+            try:
+                pooled.connection.close()
+            except Exception as e:
+                logger.error(f"Failed to close discarded synthesizer connection: {str(e)}")
+            with self._lock:
+                self._created -= 1
+                self.discarded += 1
+            return
+        self._idle.put(pooled)
+
+    def available(self):
+        """Synthesizers a checkout would get right now: idle ones plus those the pool may still open."""
+        with self._lock:
+            return self._idle.qsize() + self._size - self._created
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self._size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "in_use": len(self._in_use),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "discarded": self.discarded,
+                "connects": self.connect_count,
+                "avg_connect_ms": round(self.connect_seconds * 1000 / self.connect_count, 1) if self.connect_count else 0.0,
+            }
@@ -0,0 +1,156 @@
+"""Bank of short pre-synthesized filler lines ("Hmm, let me think...") that cover the wait for a reply.
+
+Each worker synthesizes every line in FILLER_LINES for each FILLER_PERSONALITIES x FILLER_STYLEDEGREES
+x FILLER_AUDIO_FORMATS combination in the background after it boots (see app.warm_up). Syntheses go
+through the TTS cache, so across workers and restarts on a host Azure is only called once per line.
+The finished bank is held in memory, indexed by (personality, styledegree, audio format), with the
+audio already base64-encoded. That way get() serves a filler with no upstream I/O and no encoding.
+"""
+import os
+import asyncio
+import base64
+import random
+import threading
+import logging
+import audio_formats
+import client_pool
+import metrics
+import ssml
+import tts_cache
+
+logger = logging.getLogger(__name__)
+
+FILLER_BANK = os.environ.get("FILLER_BANK", "true").lower() in ("1", "true", "yes")  # build the bank at boot
+FILLER_PERSONALITIES = [p.strip() for p in os.environ.get(
+    "FILLER_PERSONALITIES", "cheerful,excited,friendly,empathetic,sad").split(",") if p.strip()]
+FILLER_STYLEDEGREES = [d.strip() for d in os.environ.get("FILLER_STYLEDEGREES", "1").split(",") if d.strip()]
+FILLER_AUDIO_FORMATS = [f.strip() for f in os.environ.get(
+    "FILLER_AUDIO_FORMATS", audio_formats.DEFAULT_AUDIO_FORMAT).split(",") if f.strip()]
+if not set(FILLER_AUDIO_FORMATS) <= set(audio_formats.OUTPUT_FORMATS):
+    raise ValueError(f"FILLER_AUDIO_FORMATS must be among {', '.join(audio_formats.OUTPUT_FORMATS)}")
+
+# Reply bodies in the same SSML dialect Gemini writes, bookmarks included
+FILLER_LINES = (
+    '<bookmark mark="Thinking"/>Hmm, let me think...',
+    '<bookmark mark="Surprised"/>Ooh!',
+    '<bookmark mark="Silly"/>Hehe!',
+    '<bookmark mark="Head-Tilt"/>Hmm...',
+    '<bookmark mark="Happy"/>Oh, good question!',
+    '<bookmark mark="Brow-L-Raise"/>Well...',
+)
+
+FILLERS_SERVED = metrics.Counter("filler_requests_total", "Filler lookups, by whether the bank had a match",
+                                 ("result",))
+
+
+class Filler:
+    __slots__ = ("ssml", "audio", "audio_duration", "timeline")
+
+    def __init__(self, ssml, synthesis):
+        self.ssml = ssml
+        self.audio = base64.b64encode(synthesis["audio_data"]).decode("utf-8")
+        self.audio_duration = synthesis["audio_duration"]
+        self.timeline = synthesis["timeline"]
+
+    def to_dict(self, audio_format, timing_format="objects"):
+        """The audio and timing fields of an /api/respond reply, for this filler."""
+        return {
+            "audio_url": self.audio,
+            "audio_format": audio_format,
+            "audio_duration": self.audio_duration,
+            "ai_response": self.ssml,
+            **self.timeline.to_timings(timing_format),
+            "timing_format": timing_format,
+        }
+
+
+_lock = threading.Lock()
+_owner_pid = None
+_bank = {}  # (personality, styledegree, audio format) -> [Filler]
+_building = False
+_failed = 0
+_hits = 0
+_misses = 0
+
+
+async def _build(synthesize):
+    global _building, _failed
+    loop = asyncio.get_running_loop()
+    try:
+        for audio_format_name in FILLER_AUDIO_FORMATS:
+            audio_format = audio_formats.OUTPUT_FORMATS[audio_format_name]
+            for personality in FILLER_PERSONALITIES:
+                for degree in FILLER_STYLEDEGREES:
+                    entries = []
+                    for line in FILLER_LINES:
+                        document = ssml.normalize(line, client_pool.AZURE_VOICE_NAME, personality, degree)
+                        key = tts_cache.cache_key(document, client_pool.AZURE_VOICE_NAME, audio_format.sdk_name)
+                        # The disk tier does file I/O, kept off the upstream loop like run_batch_item does
+                        synthesis = await loop.run_in_executor(None, tts_cache.get, key)
+                        if synthesis is None:
+                            try:
+                                synthesis = await synthesize(document, audio_format)
+                            except Exception as e:
+                                with _lock:
+                                    _failed += 1
+                                logger.error(f"Failed to synthesize {personality} filler {line!r}: {str(e)}")
+                                continue
+                            await loop.run_in_executor(None, tts_cache.put, key, synthesis)
+                        entries.append(Filler(document, synthesis))
+                    if entries:
+                        # Published one combination at a time, so lookups use whatever is ready
+                        with _lock:
+                            _bank[(personality, degree, audio_format_name)] = entries
+        logger.info(f"Filler bank ready: {stats()['lines']} lines")
+    finally:
+        with _lock:
+            _building = False
+
+
+def start(synthesize):
+    """Build this worker's bank in the background; synthesize(ssml, audio_format) is a coroutine function.
+
+    Does nothing when FILLER_BANK is off or the bank is already built or being built in this process.
+    """
+    global _owner_pid, _bank, _building, _failed
+    if not FILLER_BANK:
+        return
+    with _lock:
+        if _owner_pid == os.getpid():
+            return
+        _owner_pid = os.getpid()
+        _bank = {}
+        _building = True
+        _failed = 0
+    client_pool.submit(_build(synthesize))
+    logger.info(f"Building filler bank for {len(FILLER_PERSONALITIES)} personalities")
+
+
+def get(personality, degree, audio_format_name):
+    """A random filler for the personality, preferring the same styledegree; None if the bank has none."""
+    global _hits, _misses
+    with _lock:
+        entries = _bank.get((personality, str(degree), audio_format_name))
+        if entries is None:
+            # Any intensity of the right personality beats silence
+            entries = next((entries for (p, _, f), entries in _bank.items()
+                            if p == personality and f == audio_format_name), None)
+        if entries is None:
+            _misses += 1
+        else:
+            _hits += 1
+    FILLERS_SERVED.inc(1, "miss" if entries is None else "hit")
+    return random.choice(entries) if entries else None
+
+
+def stats():
+    with _lock:
+        return {
+            "building": _building,
+            "combinations": len(_bank),
+            "lines": sum(len(entries) for entries in _bank.values()),
+            "bytes": sum(len(filler.audio) for entries in _bank.values() for filler in entries),
+            "failed": _failed,
+            "hits": _hits,
+            "misses": _misses,
+        }
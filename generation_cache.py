@@ -0,0 +1,110 @@
+"""Single-flight coalescing and a short-TTL result cache for Gemini generations.
+
+Frontend retries and double-sends produce identical generate_content calls against the same
+system instruction. Concurrent duplicates await the one upstream call already in flight, and
+its result is kept for a few seconds so late duplicates don't reach Gemini either.
+"""
+import os
+import asyncio
+import json
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+GEMINI_CACHE_TTL = float(os.environ.get("GEMINI_CACHE_TTL", 30))  # seconds, 0 disables the result cache
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", 256))
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def generation_key(model, system_instruction, contents):
+    return _digest("\0".join((model, _digest(system_instruction), json.dumps(contents, sort_keys=True))))
+
+
+class GenerationCache:
+    """Runs on the upstream event loop: every caller of get_or_generate is a coroutine on that loop."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()  # guards counters and maps against stats() from request threads
+        self._in_flight = {}  # key -> asyncio.Task of the upstream call
+        self._results = OrderedDict()  # key -> (expires_at, result)
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.cached = 0
+        self.errors = 0
+
+    def _cached_result(self, key, now):
+        # Called with _lock held
+        item = self._results.get(key)
+        if item is None:
+            return None
+        expires_at, result = item
+        if expires_at <= now:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return result
+
+    def _finish(self, key, task):
+        with self._lock:
+            del self._in_flight[key]
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                self.errors += 1
+                return  # failures are never cached, the next caller retries upstream
+            if self.ttl > 0:
+                self._results[key] = (time.monotonic() + self.ttl, task.result())
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+
+    async def get_or_generate(self, key, generate):
+        """Return the result of the coroutine generate() makes, sharing it with every concurrent or recent caller of the same key."""
+        with self._lock:
+            result = self._cached_result(key, time.monotonic())
+            if result is not None:
+                self.cached += 1
+                return result
+            task = self._in_flight.get(key)
+            if task is None:
+                task = self._in_flight[key] = asyncio.ensure_future(generate())
+                task.add_done_callback(partial(self._finish, key))
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+                logger.info("Coalescing duplicate Gemini request onto in-flight call")
+        # The upstream call is shared, so a caller that gives up (e.g. its fan-out sibling failed)
+        # must not cancel it for the others; it still completes and fills the result cache
+        return await asyncio.shield(task)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+                "cached": self.cached,
+                "errors": self.errors,
+                "in_flight": len(self._in_flight),
+                "entries": len(self._results),
+            }
+
+
+_cache = GenerationCache(GEMINI_CACHE_TTL, GEMINI_CACHE_MAX_ENTRIES)
+
+
+async def get_or_generate(model, system_instruction, contents, generate):
+    return await _cache.get_or_generate(generation_key(model, system_instruction, contents), generate)
+
+
+def stats():
+    return _cache.stats()
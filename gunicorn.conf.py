@@ -0,0 +1,35 @@
+"""gunicorn settings, picked up automatically by `gunicorn app:app` from the working directory.
+
+Upstream calls run on each worker's event loop, so a request waiting on Gemini or Azure only parks
+its own gthread thread. A few processes with many threads each keep hundreds of conversations in
+flight; the real limits are the providers' quotas and SYNTHESIZER_POOL_SIZE (synthesizers per worker).
+
+With preload_app the master imports the app and the provider SDKs once before forking, so workers
+share those pages copy-on-write and start without paying the imports; each worker then opens its
+clients and a first synthesizer connection (app.warm_up) before it accepts requests.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"  # Render's PORT env var
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 256))  # concurrent requests per worker
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))  # seconds; a streamed reply can take a while
+keepalive = 5
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app import and before any worker is forked
+    if preload_app:
+        import client_pool
+        client_pool.load_providers()
+
+
+def post_worker_init(worker):
+    # The worker has loaded the app (inherited, if preloaded); clients and connections are per process
+    import app
+    import sessions
+    # worker.cfg has the final worker count, command-line --workers included
+    sessions.use_workers(worker.cfg.workers)
+    app.warm_up()
@@ -0,0 +1,153 @@
+"""Low-overhead request metrics, exported in the Prometheus text format at /metrics.
+
+Stages of /api/respond are timed with `with metrics.Stage(name, timings):`, which costs two
+perf_counter() calls and one histogram update (a few microseconds). Passing a request's timings dict
+also collects the stage durations for its Server-Timing header. Like /api/stats, metrics live in each
+gunicorn worker's memory, so every series carries a pid label telling the workers apart.
+"""
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() in ("1", "true", "yes")  # add Server-Timing headers
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)  # bytes
+AUDIO_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)  # seconds of audio
+
+_PID = str(os.getpid())
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [("pid", _PID), *zip(names, values), *extra]
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)  # first bucket with value <= le
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labelvalues, (list(counts), total)) for labelvalues, (counts, total) in self._series.items())
+        for labelvalues, (counts, total) in series:
+            cumulative = 0
+            for le, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bound = le if le == "+Inf" else _number(le)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_seconds", "Time to produce the response (first byte for streams)", ("endpoint", "status"))
+STAGE_SECONDS = Histogram("respond_stage_seconds", "Latency of each /api/respond pipeline stage", ("stage",))
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "Failed upstream stages by API", ("api",))
+RESPONSE_BYTES = Counter("response_bytes_total", "Response body bytes sent", ("endpoint",))
+RESPONSE_SIZE = Histogram("response_size_bytes", "Size of non-streamed response bodies", ("endpoint",), SIZE_BUCKETS)
+AUDIO_SECONDS = Histogram("audio_seconds", "Seconds of audio per reply, by where it came from", ("source",), AUDIO_BUCKETS)
+
+
+class Stage:
+    """Times one stage into respond_stage_seconds, and into a request's timings dict if given."""
+    __slots__ = ("name", "timings", "start")
+
+    def __init__(self, name, timings=None):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.name)
+        if self.timings is not None:
+            self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def timed(name, fn, timings=None):
+    """Wrap a coroutine function (e.g. one fanned out on the upstream loop) so each call is timed as a stage."""
+    async def call():
+        with Stage(name, timings):
+            return await fn()
+    return call
+
+
+def count_stream(chunks, endpoint):
+    """Pass a streamed response body through, counting the bytes sent."""
+    for chunk in chunks:
+        RESPONSE_BYTES.inc(len(chunk), endpoint)
+        yield chunk
+
+
+def server_timing(timings):
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings.items())
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _reset_pid():
+    # Forked gunicorn workers start with the master's pid baked in
+    global _PID
+    _PID = str(os.getpid())
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pid)
@@ -0,0 +1,128 @@
+"""Registry of the Gemini system instructions.
+
+Prompts are registered once at import, minified (per-line indentation and runs of blank lines removed,
+which would otherwise be sent as input tokens on every call) and versioned by the hash of the minified
+text, so caches and logs tell prompt revisions apart. In the background, maintain() counts each prompt's
+tokens and, with PROMPT_CACHE enabled, registers prompts large enough as Gemini cached content, so calls
+reference the cache instead of resending the instruction. Cached contents are per worker and are
+recreated before they expire.
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE = os.environ.get("PROMPT_CACHE", "false").lower() in ("1", "true", "yes")  # use Gemini cached content
+PROMPT_CACHE_TTL = int(os.environ.get("PROMPT_CACHE_TTL", 3600))  # seconds a cached content lives
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", 4096))  # Gemini's minimum for explicit caching
+_REFRESH_MARGIN = 300  # seconds before expiry a cached content is replaced
+_RETRY_INTERVAL = 60  # seconds between attempts after a failed count or cache creation
+
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def minify(text):
+    lines = (line.strip() for line in text.strip().splitlines())
+    return _BLANK_RUNS.sub("\n\n", "\n".join(lines))
+
+
+class Prompt:
+    def __init__(self, name, raw):
+        self.name = name
+        self.text = minify(raw)
+        self.version = hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:12]
+        self.raw_chars = len(raw)
+        self.tokens = None
+        self.cached_content = None  # cachedContents/<id> while a live cache exists
+        self.cache_expires = 0.0
+
+    def config(self):
+        """GenerateContentConfig arguments carrying this instruction: a cache reference or the text itself."""
+        if self.cached_content and time.time() < self.cache_expires:
+            return {"cached_content": self.cached_content}
+        return {"system_instruction": self.text}
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "raw_chars": self.raw_chars,
+            "chars": len(self.text),
+            "tokens": self.tokens,
+            "cached_content": self.cached_content if time.time() < self.cache_expires else None,
+        }
+
+
+_registry = {}
+_owner_pid = None
+_task = None
+_next_check = 0.0
+
+
+def register(name, raw):
+    prompt = _registry[name] = Prompt(name, raw)
+    logger.info(f"Registered prompt {name} v{prompt.version}: {prompt.raw_chars} -> {len(prompt.text)} chars")
+    return prompt
+
+
+def get(name):
+    return _registry[name]
+
+
+async def _prepare(prompt, client, model):
+    from google.genai import types  # loaded with the client by now, see client_pool.load_providers
+    if prompt.tokens is None:
+        counted = await client.aio.models.count_tokens(model=model, contents=[prompt.text])
+        prompt.tokens = counted.total_tokens
+        logger.info(f"Prompt {prompt.name} v{prompt.version} is {prompt.tokens} tokens")
+    if not PROMPT_CACHE or prompt.tokens < PROMPT_CACHE_MIN_TOKENS:
+        return
+    if prompt.cached_content and time.time() < prompt.cache_expires - _REFRESH_MARGIN:
+        return
+    cache = await client.aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+        system_instruction=prompt.text,
+        display_name=f"{prompt.name}-{prompt.version}",
+        ttl=f"{PROMPT_CACHE_TTL}s"))
+    # The old cache, if any, simply expires; requests in flight may still reference it
+    prompt.cached_content = cache.name
+    prompt.cache_expires = time.time() + PROMPT_CACHE_TTL
+    logger.info(f"Cached prompt {prompt.name} v{prompt.version} as {cache.name}")
+
+
+async def _maintain(client, model):
+    global _next_check
+    retry = False
+    for prompt in list(_registry.values()):
+        try:
+            await _prepare(prompt, client, model)
+        except Exception as e:
+            retry = True
+            logger.error(f"Failed to prepare prompt {prompt.name}: {str(e)}")
+    # Until everything is prepared, look again soon; afterwards only when a cache needs replacing
+    _next_check = time.time() + (_RETRY_INTERVAL if retry else PROMPT_CACHE_TTL - _REFRESH_MARGIN)
+
+
+def maintain(client, model):
+    """Start counting and caching prompts in the background when due; never blocks the caller.
+
+    Runs on the upstream event loop (from generate_content or the worker warm-up).
+    """
+    global _owner_pid, _task, _next_check
+    if _owner_pid != os.getpid():
+        # Cached contents and counts are per worker, a forked worker starts over
+        _owner_pid = os.getpid()
+        _task = None
+        _next_check = 0.0
+        for prompt in _registry.values():
+            prompt.cached_content = None
+            prompt.cache_expires = 0.0
+    if time.time() < _next_check or (_task is not None and not _task.done()):
+        return
+    _task = asyncio.ensure_future(_maintain(client, model))
+
+
+def stats():
+    return {name: prompt.stats() for name, prompt in _registry.items()}
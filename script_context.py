@@ -0,0 +1,122 @@
+"""Schema, parsing and validation of the split-context (video segmentation) generation.
+
+The generation is requested as JSON constrained by SCHEMA, so fences and prose around it should not
+occur; parse() still repairs the usual slips (code fences, text around the object, trailing commas)
+before giving up. Segments are kept as compact __slots__ objects and only turned into dicts when a
+reply is serialized. Outcomes are counted in script_context_parse_total instead of being dropped.
+"""
+import re
+import json
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STYLE = "realistic"
+
+# A plain SchemaDict, which GenerateContentConfig accepts as response_schema, so importing this module
+# doesn't load google.genai
+SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "segments": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "text": {"type": "STRING"},
+                    "visual_representation_of_text": {"type": "STRING"},
+                    "style_modifier": {"type": "STRING"},
+                },
+                "required": ["text", "visual_representation_of_text", "style_modifier"],
+                "property_ordering": ["text", "visual_representation_of_text", "style_modifier"],
+            },
+        },
+        "script_scene_style": {"type": "STRING"},
+    },
+    "required": ["segments", "script_scene_style"],
+    "property_ordering": ["segments", "script_scene_style"],
+}
+
+PARSE_OUTCOMES = metrics.Counter("script_context_parse_total",
+                                 "Split-context generations by parse outcome (ok, repaired, retried, failed)",
+                                 ("outcome",))
+
+_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+
+class ScriptContextError(ValueError):
+    """The generation isn't a valid split-context document."""
+
+
+class Segment:
+    __slots__ = ("text", "visual_representation_of_text", "style_modifier")
+
+    def __init__(self, text, visual_representation_of_text, style_modifier):
+        self.text = text
+        self.visual_representation_of_text = visual_representation_of_text
+        self.style_modifier = style_modifier
+
+    def to_dict(self):
+        return {
+            "text": self.text,
+            "visual_representation_of_text": self.visual_representation_of_text,
+            "style_modifier": self.style_modifier,
+        }
+
+
+def validate(data):
+    """Turn a decoded document into (segments, style), raising ScriptContextError on anything malformed."""
+    if not isinstance(data, dict):
+        raise ScriptContextError(f"expected an object, got {type(data).__name__}")
+    items = data.get("segments")
+    if not isinstance(items, list):
+        raise ScriptContextError("segments must be a list")
+    segments = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ScriptContextError(f"segment {index} is not an object")
+        text = item.get("text")
+        visual = item.get("visual_representation_of_text")
+        if not isinstance(text, str) or not text.strip():
+            raise ScriptContextError(f"segment {index} has no text")
+        if not isinstance(visual, str) or not visual.strip():
+            raise ScriptContextError(f"segment {index} has no visual_representation_of_text")
+        modifier = item.get("style_modifier", "")
+        segments.append(Segment(text, visual, modifier if isinstance(modifier, str) else ""))
+    style = data.get("script_scene_style")
+    return segments, style if isinstance(style, str) and style.strip() else DEFAULT_STYLE
+
+
+def _repair(text):
+    # The slips models make around otherwise fine JSON: fences, prose around the object, trailing commas
+    cleaned = _FENCE.sub("", text.strip())
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start != -1 and end > start:
+        cleaned = cleaned[start:end + 1]
+    return _TRAILING_COMMA.sub(r"\1", cleaned)
+
+
+def parse(text):
+    """Parse a split-context generation into (segments, style), repairing it once if needed.
+
+    Returns (segments, style, repaired); raises ScriptContextError when the text can't be used.
+    """
+    if not text:
+        raise ScriptContextError("empty generation")
+    try:
+        return (*validate(json.loads(text)), False)
+    except ValueError as e:  # json.JSONDecodeError and ScriptContextError
+        first_error = e
+    repaired = _repair(text)
+    if repaired != text:
+        try:
+            return (*validate(json.loads(repaired)), True)
+        except ValueError:
+            pass
+    raise ScriptContextError(str(first_error))
+
+
+def to_json(segments):
+    return [segment.to_dict() for segment in segments]
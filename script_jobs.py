@@ -0,0 +1,210 @@
+"""Background jobs for deferred script-context (video segmentation) generation.
+
+The split-context generation is the heaviest Gemini call of a request, and the chat reply and its
+audio don't depend on it. With "getScriptContext": "deferred" the reply returns a job id right away
+and the generation runs on a small pool of worker coroutines on the upstream event loop, fed by a
+bounded queue. Job records are JSON files in a directory shared by every worker on the host, so
+/api/script-context/<id> can be polled on any worker; they expire after SCRIPT_CONTEXT_TTL.
+"""
+import os
+import re
+import json
+import uuid
+import asyncio
+import tempfile
+import threading
+import time
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import client_pool
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_CONTEXT_WORKERS = int(os.environ.get("SCRIPT_CONTEXT_WORKERS", 2))  # concurrent generations per worker
+SCRIPT_CONTEXT_QUEUE_SIZE = int(os.environ.get("SCRIPT_CONTEXT_QUEUE_SIZE", 64))  # jobs waiting per worker
+SCRIPT_CONTEXT_TTL = float(os.environ.get("SCRIPT_CONTEXT_TTL", 600))  # seconds a finished job stays pollable
+SCRIPT_CONTEXT_DIR = os.environ.get("SCRIPT_CONTEXT_DIR") or os.path.join(tempfile.gettempdir(), "ai-anime-dating-script-context")
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+_SWEEP_INTERVAL = 60  # seconds
+
+_lock = threading.Lock()
+_owner_pid = None
+_queue = None
+_futures = {}  # job id -> Future of the job record, for streams waiting in this process
+_last_sweep = 0.0
+_queued = 0
+_running = 0
+_completed = 0
+_failed = 0
+_rejected = 0
+
+
+def _path(job_id):
+    return os.path.join(SCRIPT_CONTEXT_DIR, job_id + ".json")
+
+
+def _write(job_id, record):
+    os.makedirs(SCRIPT_CONTEXT_DIR, exist_ok=True)
+    # Write to a temp file and rename so a concurrent poll never reads a partial record
+    fd, tmp_path = tempfile.mkstemp(dir=SCRIPT_CONTEXT_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(record, f, separators=(",", ":"))
+    os.replace(tmp_path, _path(job_id))
+
+
+def _store(job_id, record):
+    try:
+        _write(job_id, record)
+    except Exception as e:
+        logger.error(f"Failed to store script context job {job_id}: {str(e)}")
+
+
+def _finish(job_id, record):
+    _store(job_id, record)
+    future = _futures.pop(job_id, None)
+    if future is not None:
+        future.set_result(record)
+
+
+async def _worker(queue):
+    global _queued, _running, _completed, _failed
+    loop = asyncio.get_running_loop()
+    while True:
+        job_id, job = await queue.get()
+        with _lock:
+            _queued -= 1
+            _running += 1
+        # Job records are files, written off the loop so upstream calls in flight aren't held up
+        await loop.run_in_executor(None, _store, job_id, {"id": job_id, "status": "running"})
+        try:
+            record = {"id": job_id, "status": "done", **(await job())}
+            with _lock:
+                _completed += 1
+            logger.info(f"Script context job {job_id} completed")
+        except Exception as e:
+            # PipelineErrors carry the usual error JSON fields, anything else is reported generically
+            record = {
+                "id": job_id,
+                "status": "failed",
+                "error": getattr(e, "error", "Script Context Generation Failed"),
+                "details": getattr(e, "details", str(e)),
+                "api": getattr(e, "api", "Google Gemini (Script Context)"),
+            }
+            with _lock:
+                _failed += 1
+            logger.error(f"Script context job {job_id} failed: {str(e)}")
+        finally:
+            with _lock:
+                _running -= 1
+        await loop.run_in_executor(None, _finish, job_id, record)
+
+
+def _ensure_workers():
+    # Called with _lock held. Worker coroutines live on this process's upstream loop.
+    global _owner_pid, _futures, _queued, _running
+    pid = os.getpid()
+    if _owner_pid == pid:
+        return
+    _owner_pid = pid
+    _futures = {}
+    _queued = _running = 0
+    loop = client_pool.get_event_loop()
+
+    def start():
+        # Created on the loop itself; bounded by the _queued count, so submit() can refuse without a round trip
+        global _queue
+        _queue = asyncio.Queue()
+        for _ in range(SCRIPT_CONTEXT_WORKERS):
+            loop.create_task(_worker(_queue))
+    loop.call_soon_threadsafe(start)
+    logger.info(f"Started {SCRIPT_CONTEXT_WORKERS} script context job workers")
+
+
+def submit(job):
+    """Queue job, a coroutine function returning {"splitContext", "style"}, and return its id.
+
+    When the queue is full the job is recorded as failed right away instead of waiting. Writes job records,
+    so call it from a request thread or an executor, never on the upstream loop.
+    """
+    global _queued, _rejected
+    job_id = uuid.uuid4().hex
+    _maybe_sweep()
+    with _lock:
+        _ensure_workers()
+        accepted = _queued < SCRIPT_CONTEXT_QUEUE_SIZE
+        if accepted:
+            _queued += 1
+            _futures[job_id] = Future()
+        else:
+            _rejected += 1
+    if not accepted:
+        logger.error(f"Script context queue is full ({SCRIPT_CONTEXT_QUEUE_SIZE} jobs), rejecting job {job_id}")
+        _store(job_id, {
+            "id": job_id,
+            "status": "failed",
+            "error": "Script Context Queue Full",
+            "details": f"{SCRIPT_CONTEXT_QUEUE_SIZE} script context jobs are already waiting, try again later",
+            "api": "Script Context Jobs",
+        })
+        return job_id
+    _store(job_id, {"id": job_id, "status": "queued"})
+    # Runs after the workers' start() callback, which was scheduled first
+    client_pool.get_event_loop().call_soon_threadsafe(lambda: _queue.put_nowait((job_id, job)))
+    logger.info(f"Queued script context job {job_id}")
+    return job_id
+
+
+def lookup(job_id):
+    """Return the job record, or None if the id is unknown or expired."""
+    if not _JOB_ID.match(job_id):
+        return None
+    path = _path(job_id)
+    try:
+        if os.stat(path).st_mtime + SCRIPT_CONTEXT_TTL <= time.time():
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def wait(job_id, timeout):
+    """Block until a job submitted by this process finishes; returns its record (or the current one on timeout)."""
+    future = _futures.get(job_id)
+    if future is not None:
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            pass
+    return lookup(job_id)
+
+
+def _maybe_sweep():
+    global _last_sweep
+    now = time.time()
+    with _lock:
+        if now - _last_sweep < _SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+    try:
+        entries = list(os.scandir(SCRIPT_CONTEXT_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime + SCRIPT_CONTEXT_TTL <= now:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def stats():
+    with _lock:
+        return {
+            "queued": _queued,
+            "running": _running,
+            "completed": _completed,
+            "failed": _failed,
+            "rejected": _rejected,
+        }
@@ -0,0 +1,396 @@
+"""Server-side conversation sessions for /api/respond.
+
+Session ids are minted by the server (new_id) and returned with the reply; a request carrying one
+gets the conversation so far put in front of its question: a rolling summary of older turns followed
+by the last SESSION_MAX_TURNS turns verbatim. The prompt stays bounded however
+long the date runs, so clients no longer resend their history. Each session keeps a ring buffer of
+at most SESSION_MAX_TURNS recent turns plus the turns waiting to be summarized. Once
+SESSION_SUMMARY_BATCH turns have left the recent window, they are folded into the summary in the
+background on the upstream event loop (see app.summarize_session), so requests never wait for it.
+
+SESSION_STORE=memory keeps sessions in each worker's memory; SESSION_STORE=sqlite keeps them in SESSION_DB,
+shared by every worker on the host and kept across restarts. Unset, sqlite is used when gunicorn runs more
+than one worker (see use_workers), since a session's turns would otherwise be spread over the workers.
+Sessions expire SESSION_TTL seconds after their last turn.
+"""
+import os
+import re
+import time
+import secrets
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import logging
+from collections import deque, namedtuple
+import client_pool
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "")  # "memory" (per worker), "sqlite" (per host) or "" (by workers)
+SESSION_DB = os.environ.get("SESSION_DB") or os.path.join(tempfile.gettempdir(), "ai-anime-dating-sessions.sqlite3")
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 24 * 3600))  # seconds a session lives after its last turn
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", 6))  # recent turns sent verbatim
+SESSION_SUMMARY_BATCH = int(os.environ.get("SESSION_SUMMARY_BATCH", 4))  # older turns folded into the summary at once
+SESSION_TURN_MAX_CHARS = int(os.environ.get("SESSION_TURN_MAX_CHARS", 1000))  # per message and per reply
+SESSION_SUMMARY_MAX_CHARS = int(os.environ.get("SESSION_SUMMARY_MAX_CHARS", 2000))
+if SESSION_STORE not in ("", "memory", "sqlite"):
+    raise ValueError("SESSION_STORE must be memory or sqlite")
+
+# Turns kept per session: the recent window plus room for two batches waiting on a slow summary
+SESSION_CAPACITY = SESSION_MAX_TURNS + 2 * SESSION_SUMMARY_BATCH
+
+SESSION_ID_BYTES = 16  # random bytes in a minted id, 22 URL-safe characters
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{22,64}$")
+_SWEEP_INTERVAL = 60  # seconds
+
+SESSION_COMPACTIONS = metrics.Counter("session_compactions_total", "Session summary updates by outcome (ok, failed)",
+                                      ("outcome",))
+
+Turn = namedtuple("Turn", ["index", "user", "reply"])
+
+
+class Session:
+    __slots__ = ("summary", "summary_through", "turns")
+
+    def __init__(self, summary, summary_through, turns):
+        self.summary = summary
+        self.summary_through = summary_through  # index of the last turn folded into the summary
+        self.turns = turns  # turns after summary_through, oldest first
+
+    def pending(self):
+        """Turns that have left the recent window but aren't in the summary yet."""
+        return self.turns[:max(0, len(self.turns) - SESSION_MAX_TURNS)]
+
+
+class MemoryStore:
+    def __init__(self, ttl, capacity):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._sessions = {}  # id -> [summary, summary_through, deque of turns, next index, updated]
+        self.dropped = 0
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[4] + self.ttl <= time.time():
+                return None
+            return Session(entry[0], entry[1], list(entry[2]))
+
+    def append(self, session_id, user, reply):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[4] + self.ttl <= now:
+                entry = self._sessions[session_id] = ["", 0, deque(maxlen=self.capacity), 1, now]
+            turns = entry[2]
+            if len(turns) == turns.maxlen:
+                self.dropped += 1  # the summary fell a whole batch behind, the oldest turn is lost
+            turns.append(Turn(entry[3], user, reply))
+            entry[3] += 1
+            entry[4] = now
+            return Session(entry[0], entry[1], list(turns))
+
+    def compact(self, session_id, through, summary):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] >= through:
+                return False
+            entry[0], entry[1] = summary, through
+            turns = entry[2]
+            while turns and turns[0].index <= through:
+                turns.popleft()
+            return True
+
+    def sweep(self, now):
+        with self._lock:
+            for session_id in [i for i, entry in self._sessions.items() if entry[4] + self.ttl <= now]:
+                del self._sessions[session_id]
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summary_through INTEGER NOT NULL DEFAULT 0,
+    next_index INTEGER NOT NULL DEFAULT 1,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    reply TEXT NOT NULL,
+    PRIMARY KEY (session_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+"""
+
+
+class SQLiteStore:
+    """The same operations as MemoryStore on a SQLite file shared by the workers of a host.
+
+    Each process opens one connection, used under a lock; statements take well under a millisecond.
+    """
+
+    def __init__(self, path, ttl, capacity):
+        self.path = path
+        self.ttl = ttl
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")  # readers in other workers don't block writers
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self.dropped = 0
+
+    def _load(self, session_id, now):
+        row = self._connection.execute("SELECT summary, summary_through, updated FROM sessions WHERE id = ?",
+                                       (session_id,)).fetchone()
+        if row is None or row[2] + self.ttl <= now:
+            return None
+        turns = [Turn(*turn) for turn in self._connection.execute(
+            "SELECT idx, user, reply FROM turns WHERE session_id = ? ORDER BY idx", (session_id,))]
+        return Session(row[0], row[1], turns)
+
+    def load(self, session_id):
+        with self._lock:
+            return self._load(session_id, time.time())
+
+    def append(self, session_id, user, reply):
+        now = time.time()
+        db = self._connection
+        with self._lock:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT next_index, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                if row is None or row[1] + self.ttl <= now:
+                    db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                    db.execute("INSERT OR REPLACE INTO sessions (id, updated) VALUES (?, ?)", (session_id, now))
+                    index = 1
+                else:
+                    index = row[0]
+                db.execute("INSERT INTO turns (session_id, idx, user, reply) VALUES (?, ?, ?, ?)",
+                           (session_id, index, user, reply))
+                db.execute("UPDATE sessions SET next_index = ?, updated = ? WHERE id = ?", (index + 1, now, session_id))
+                dropped = db.execute("DELETE FROM turns WHERE session_id = ? AND idx <= ?",
+                                     (session_id, index - self.capacity)).rowcount
+                session = self._load(session_id, now)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self.dropped += dropped
+            return session
+
+    def compact(self, session_id, through, summary):
+        db = self._connection
+        with self._lock:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Another worker may have summarized these turns already
+                updated = db.execute("UPDATE sessions SET summary = ?, summary_through = ? "
+                                     "WHERE id = ? AND summary_through < ?",
+                                     (summary, through, session_id, through)).rowcount
+                if updated:
+                    db.execute("DELETE FROM turns WHERE session_id = ? AND idx <= ?", (session_id, through))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return bool(updated)
+
+    def sweep(self, now):
+        db = self._connection
+        with self._lock:
+            cutoff = now - self.ttl
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("DELETE FROM turns WHERE session_id IN (SELECT id FROM sessions WHERE updated <= ?)", (cutoff,))
+                db.execute("DELETE FROM sessions WHERE updated <= ?", (cutoff,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+_lock = threading.Lock()
+_owner_pid = None
+_store = None
+_workers = 1  # server processes on this host, set by use_workers
+_compacting = set()  # session ids with a summary update running in this process
+_last_sweep = 0.0
+_recorded = 0
+_compactions = 0
+_compaction_failures = 0
+_errors = 0
+
+
+def use_workers(count):
+    """Tell the module how many worker processes serve requests; call before the first request."""
+    global _workers
+    with _lock:
+        _workers = count
+
+
+def store_kind():
+    """SESSION_STORE, or when unset sqlite for several workers and memory for one."""
+    return SESSION_STORE or ("sqlite" if _workers > 1 else "memory")
+
+
+def _get_store():
+    global _owner_pid, _store, _compacting
+    with _lock:
+        # A SQLite connection must not be used across a fork, and a worker's memory sessions are its own
+        if _owner_pid != os.getpid():
+            _owner_pid = os.getpid()
+            _compacting = set()
+            kind = store_kind()
+            if kind == "sqlite":
+                _store = SQLiteStore(SESSION_DB, SESSION_TTL, SESSION_CAPACITY)
+            else:
+                _store = MemoryStore(SESSION_TTL, SESSION_CAPACITY)
+            logger.info(f"Using {kind} session store")
+        return _store
+
+
+def new_id():
+    """A fresh session id: unguessable, so only the client it was returned to can continue the session."""
+    return secrets.token_urlsafe(SESSION_ID_BYTES)
+
+
+def valid_id(session_id):
+    return isinstance(session_id, str) and bool(_SESSION_ID.match(session_id))
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit].rstrip() + "..."
+
+
+def _transcript(turns):
+    return "\n".join(f"User: {turn.user}\nYou: {turn.reply}" for turn in turns)
+
+
+def history(session_id):
+    """The conversation so far, as a prompt prefix for the next question.
+
+    Returns None when the store has no such session (never created here, or expired); a store failure
+    is logged and returns "", so the conversation goes on without its history rather than restarting.
+    """
+    global _errors
+    try:
+        session = _get_store().load(session_id)
+    except Exception as e:
+        with _lock:
+            _errors += 1
+        logger.error(f"Failed to load session {session_id}: {str(e)}")
+        return ""
+    if session is None:
+        return None
+    prefix = ""
+    if session.summary:
+        prefix += f"Summary of the conversation so far:\n{session.summary}\n\n"
+    if session.turns:
+        # Turns still waiting for the summary are left out, so the prompt never grows past the window
+        prefix += f"Most recent turns:\n{_transcript(session.turns[-SESSION_MAX_TURNS:])}\n\n"
+    return prefix
+
+
+def summary_request(summary, turns):
+    """The question asking Gemini to fold turns into the summary."""
+    return f"Current summary:\n{summary or '(none yet)'}\n\nNew turns:\n{_transcript(turns)}"
+
+
+def record(session_id, user, reply, summarize):
+    """Store a finished turn; starts a background summary update when enough turns have left the window.
+
+    summarize(summary, turns) is a coroutine function returning the new summary text. Store failures
+    are logged, never raised: the reply has already been produced.
+    """
+    global _recorded, _errors
+    _maybe_sweep()
+    try:
+        session = _get_store().append(session_id, _clip(user, SESSION_TURN_MAX_CHARS),
+                                      _clip(reply, SESSION_TURN_MAX_CHARS))
+    except Exception as e:
+        with _lock:
+            _errors += 1
+        logger.error(f"Failed to record a turn of session {session_id}: {str(e)}")
+        return
+    pending = session.pending()
+    with _lock:
+        _recorded += 1
+        if len(pending) < SESSION_SUMMARY_BATCH or session_id in _compacting:
+            return
+        _compacting.add(session_id)
+    client_pool.submit(_compact(session_id, session.summary, pending, summarize))
+
+
+async def _compact(session_id, summary, pending, summarize):
+    global _compactions, _compaction_failures
+    loop = asyncio.get_running_loop()
+    try:
+        updated = _clip((await summarize(summary, pending)).strip(), SESSION_SUMMARY_MAX_CHARS)
+        if not updated:
+            raise ValueError("empty summary")
+        # Store calls may touch the disk, kept off the upstream loop
+        stored = await loop.run_in_executor(None, _get_store().compact, session_id, pending[-1].index, updated)
+        with _lock:
+            _compactions += 1
+        SESSION_COMPACTIONS.inc(1, "ok")
+        logger.info(f"Summarized {len(pending)} turns of session {session_id}"
+                    + ("" if stored else ", already summarized elsewhere"))
+    except Exception as e:
+        # The turns stay pending and are retried with the next turn
+        with _lock:
+            _compaction_failures += 1
+        SESSION_COMPACTIONS.inc(1, "failed")
+        logger.error(f"Failed to summarize session {session_id}: {str(e)}")
+    finally:
+        with _lock:
+            _compacting.discard(session_id)
+
+
+def _maybe_sweep():
+    global _last_sweep, _errors
+    now = time.time()
+    with _lock:
+        if now - _last_sweep < _SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+    try:
+        _get_store().sweep(now)
+    except Exception as e:
+        with _lock:
+            _errors += 1
+        logger.error(f"Failed to expire sessions: {str(e)}")
+
+
+def stats():
+    store = _store if _owner_pid == os.getpid() else None
+    with _lock:
+        result = {
+            "store": store_kind(),
+            "recorded": _recorded,
+            "compacting": len(_compacting) if store is not None else 0,
+            "compactions": _compactions,
+            "compaction_failures": _compaction_failures,
+            "errors": _errors,
+        }
+    if store is not None:
+        try:
+            result["sessions"] = store.count()
+        except Exception:
+            result["sessions"] = None
+        result["dropped_turns"] = store.dropped
+    return result
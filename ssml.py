@@ -0,0 +1,246 @@
+"""SSML helpers for the synthesis pipeline.
+
+normalize turns a Gemini reply into the SSML document sent to Azure in one pass: it extracts the body
+(from code fences and any <speak>/<voice>/<mstts:express-as> wrapper the model wrote), repairs the
+usual LLM mistakes (unclosed or stray tags, non-self-closed <break>/<bookmark>, unknown elements,
+bookmarks outside the animation set, unescaped "&"), wraps the body in the voice and speaking style of
+the request and checks the result is well-formed XML, so bad SSML fails before any Azure round trip.
+
+split_ssml cuts a <speak> document into independently synthesizable documents at sentence ends
+and <break> tags. Every element open at a cut (<speak>, <voice>, <mstts:express-as>, <prosody>...)
+is closed at the end of one piece and re-opened at the start of the next, so each piece keeps the
+voice, speaking style and prosody it had in the original document.
+"""
+import os
+import re
+import html
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr
+import metrics
+
+SSML_MAX_PIECES = int(os.environ.get("SSML_MAX_PIECES", 4))
+SSML_MIN_PIECE_CHARS = int(os.environ.get("SSML_MIN_PIECE_CHARS", 80))  # spoken characters per piece
+
+_TOKEN = re.compile(r"<[^>]*>|[^<]+")
+_TAG_NAME = re.compile(r"</?\s*([\w:.-]+)")
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)]*\s+")
+_ENDS_SENTENCE = re.compile(r"[.!?…]+[\"'”’)]*\s+$")
+_TAG_OR_SPACE = re.compile(r"<[^>]*>|\s+")
+
+
+# Bookmarks drive character animations: the movements of the chat prompt and the emotions of the direct prompt
+ANIMATION_BOOKMARKS = (
+    "Body-Tilt", "Neck-Shift", "Head-Tilt", "Head-X", "Head-Y", "Brow-L-Tilt", "Brow-R-Tilt", "Brow-L-Raise",
+    "Brow-R-Raise", "Pupils-Y", "Pupils-X", "Blink",
+    "Happy", "Sad", "Content", "Angry", "Confused", "Bored", "Surprised", "Irritated", "WTF", "Confident", "Fear",
+    "Bereft", "Flirty", "Serious", "Silly", "Deadpan", "Suspicious", "Pouty", "Rage", "Disgusted", "Thinking",
+)
+SSML_ALLOWED_BOOKMARKS = [mark.strip() for mark in os.environ.get("SSML_ALLOWED_BOOKMARKS", "").split(",") if mark.strip()] \
+    or ANIMATION_BOOKMARKS  # comma-separated override of the animation set
+_BOOKMARKS = {mark.lower(): mark for mark in SSML_ALLOWED_BOOKMARKS}
+
+# Elements kept inside <mstts:express-as>; anything else is unwrapped to its text
+_CONTAINERS = {"prosody", "emphasis", "say-as", "sub", "phoneme", "p", "s", "lang", "w"}
+_EMPTY = {"break", "bookmark", "mstts:silence"}
+_WRAPPERS = {"speak", "voice", "mstts:express-as"}  # written by normalize itself
+
+# Tags must start with a name, so a lone "<" in the text stays text
+_NORMALIZE_TOKEN = re.compile(r"</?[A-Za-z!?][^<>]*>|<|[^<]+")
+_UNQUOTED_ATTR = re.compile(r"""(\s[\w:-]+\s*=\s*)([^\s"'>/][^\s"'>]*?)(?=\s|/?>)""")
+_FENCE = re.compile(r"^\s*```[\w-]*[ \t]*\n?|\n?```\s*$")
+_MARK = re.compile(r"""\bmark\s*=\s*["']([^"']*)["']""")
+
+SSML_REPAIRS = metrics.Counter("ssml_repairs_total", "Fixes applied to generated SSML before synthesis", ("repair",))
+SSML_REJECTED = metrics.Counter("ssml_rejected_total", "Generated SSML still malformed after repairs")
+
+
+class SSMLError(ValueError):
+    """Generated SSML that can't be turned into a well-formed document."""
+
+
+def normalize(raw, voice, style, styledegree):
+    """Return the <speak> document for a generated reply, spoken by voice in style at styledegree.
+
+    Raises SSMLError when the reply has nothing to speak or stays malformed after repairs.
+    """
+    repairs = []
+    text = raw.strip()
+    if text.startswith("```"):
+        text = _FENCE.sub("", text)
+        repairs.append("code_fence")
+
+    body = []
+    stack = []  # names of the elements open in body
+    for match in _NORMALIZE_TOKEN.finditer(text):
+        token = match.group(0)
+        if token == "<":
+            body.append("&lt;")
+            repairs.append("unescaped_text")
+            continue
+        if not token.startswith("<"):
+            # Entities are decoded so word timings match the spoken text, then only XML's specials re-escaped
+            body.append(escape(html.unescape(token)))
+            continue
+        if token.startswith("<?") or token.startswith("<!"):
+            continue
+        name_match = _TAG_NAME.match(token)
+        if name_match is None:
+            # "</!x>", "</?x>": tag-shaped, but with no element name to keep
+            repairs.append("unknown_element")
+            continue
+        name = name_match.group(1).lower()
+        closing = token.startswith("</")
+        if name in _WRAPPERS:
+            continue
+        quoted = _UNQUOTED_ATTR.sub(r'\1"\2"', token)
+        if quoted != token:
+            token = quoted
+            repairs.append("attribute_quotes")
+        if name in _EMPTY:
+            if closing:
+                repairs.append("stray_close")
+                continue
+            if name == "bookmark":
+                mark = _MARK.search(token)
+                canonical = _BOOKMARKS.get(mark.group(1).strip().lower()) if mark else None
+                if canonical is None:
+                    repairs.append("unknown_bookmark")
+                    continue
+                body.append(f"<bookmark mark={quoteattr(canonical)}/>")
+                if mark.group(1) != canonical:
+                    repairs.append("bookmark_case")
+                continue
+            token = "<" + name + token[name_match.end():]
+            if not token.rstrip(" >").endswith("/"):
+                token = token.rstrip(" >") + "/>"
+                repairs.append("self_close")
+            body.append(token)
+        elif name not in _CONTAINERS:
+            repairs.append("unknown_element")
+        elif closing:
+            if name not in stack:
+                repairs.append("stray_close")
+                continue
+            # Close whatever the model left open inside this element first
+            while stack[-1] != name:
+                body.append(f"</{stack.pop()}>")
+                repairs.append("unclosed")
+            stack.pop()
+            body.append(f"</{name}>")
+        elif token.rstrip(" >").endswith("/"):
+            continue  # an empty <prosody/> says nothing
+        else:
+            stack.append(name)
+            body.append("<" + name + token[name_match.end():])  # <Prosody ...> closes as </prosody>
+    while stack:
+        body.append(f"</{stack.pop()}>")
+        repairs.append("unclosed")
+
+    body = "".join(body).strip()
+    for repair in repairs:
+        SSML_REPAIRS.inc(1, repair)
+    if not _TAG_OR_SPACE.sub("", body):
+        SSML_REJECTED.inc()
+        raise SSMLError("The generated reply has no text to speak")
+
+    #https://learn.microsoft.com/en-us/azure/ai-services/speech-service/language-support?tabs=tts#voice-styles-and-roles
+    document = ('<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" '
+                'xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="en-US">'
+                f'<voice name={quoteattr(voice)}><mstts:express-as style={quoteattr(style)} '
+                f'styledegree={quoteattr(str(styledegree))}>{body}</mstts:express-as></voice></speak>')
+    try:
+        ElementTree.fromstring(document)
+    except ElementTree.ParseError as e:
+        SSML_REJECTED.inc()
+        raise SSMLError(f"Generated SSML is not well-formed: {str(e)}")
+    return document
+
+
+def plain_text(document):
+    """The words a normalized document speaks, without markup (for conversation history)."""
+    return " ".join("".join(ElementTree.fromstring(document).itertext()).split())
+
+
+def _tokenize(ssml):
+    # Text runs are further cut after sentence-ending punctuation so sentence ends become cut points
+    for match in _TOKEN.finditer(ssml):
+        token = match.group(0)
+        if token.startswith("<"):
+            yield token
+            continue
+        start = 0
+        for end in _SENTENCE_END.finditer(token):
+            yield token[start:end.end()]
+            start = end.end()
+        if start < len(token):
+            yield token[start:]
+
+
+def split_ssml(ssml, max_pieces=SSML_MAX_PIECES, min_piece_chars=SSML_MIN_PIECE_CHARS):
+    """Split an SSML document into at most max_pieces well-formed documents, in speaking order.
+
+    Returns [ssml] unchanged when the document is too short to be worth splitting.
+    """
+    tokens = list(_tokenize(ssml.strip()))
+
+    # Pass 1: track open elements and spoken characters, and collect the positions we may cut after
+    stack = []  # (name, open tag) of elements open after the current token
+    open_after = []  # copy of the stack after each token
+    chars_after = []  # spoken characters up to and including each token
+    candidates = []
+    spoken = 0
+    for i, token in enumerate(tokens):
+        candidate = False
+        if token.startswith("<?") or token.startswith("<!"):
+            pass
+        elif token.startswith("</"):
+            name = _TAG_NAME.match(token).group(1)
+            # Pop to the matching element; tolerant of LLM output that closes tags out of order
+            for j in range(len(stack) - 1, -1, -1):
+                if stack[j][0] == name:
+                    del stack[j:]
+                    break
+        elif token.startswith("<"):
+            match = _TAG_NAME.match(token)
+            if match is None:
+                pass
+            elif token.rstrip(" >").endswith("/"):
+                candidate = match.group(1) == "break"
+            else:
+                stack.append((match.group(1), token))
+        else:
+            spoken += len(token.strip())
+            candidate = bool(_ENDS_SENTENCE.search(token))
+        open_after.append(list(stack))
+        chars_after.append(spoken)
+        # Only cut inside the document, never before its root element opens or after it closes
+        if candidate and stack:
+            candidates.append(i)
+
+    if max_pieces <= 1 or spoken < 2 * min_piece_chars:
+        return [ssml]
+
+    # Pass 2: greedily pick cuts so every piece has roughly an equal share of the spoken text
+    target = max(min_piece_chars, spoken // max_pieces)
+    cuts = []
+    last_chars = 0
+    for i in candidates:
+        if len(cuts) == max_pieces - 1:
+            break
+        if chars_after[i] - last_chars >= target and spoken - chars_after[i] >= min_piece_chars:
+            cuts.append(i)
+            last_chars = chars_after[i]
+    if not cuts:
+        return [ssml]
+
+    # Pass 3: close every open element at each cut and re-open it at the start of the next piece
+    pieces = []
+    start = 0
+    prefix = ""
+    for i in cuts:
+        closing = "".join(f"</{name}>" for name, _ in reversed(open_after[i]))
+        pieces.append(prefix + "".join(tokens[start:i + 1]) + closing)
+        prefix = "".join(open_tag for _, open_tag in open_after[i])
+        start = i + 1
+    pieces.append(prefix + "".join(tokens[start:]))
+    return pieces
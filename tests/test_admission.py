@@ -0,0 +1,123 @@
+import threading
+import time
+import pytest
+from flask import Flask
+import admission
+from admission import BULK, INTERACTIVE, AdmissionController
+
+
+class Clock:
+    """Stands in for time.monotonic, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "monotonic", clock)
+    return clock
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def queue_in_thread(controller, priority, admitted):
+    thread = threading.Thread(target=lambda: controller.acquire(priority) and admitted.append(priority))
+    thread.start()
+    return thread
+
+
+def test_admits_up_to_capacity_then_queues():
+    controller = AdmissionController(2, 4, 2, 5.0)
+    assert controller.acquire(INTERACTIVE) and controller.acquire(INTERACTIVE)
+    admitted = []
+    thread = queue_in_thread(controller, INTERACTIVE, admitted)
+    wait_until(lambda: controller.stats()["waiting_interactive"] == 1)
+    assert admitted == []
+    controller.release()
+    thread.join(2)
+    assert admitted == [INTERACTIVE]
+    assert controller.stats()["in_flight"] == 2
+
+
+def test_interactive_waiter_is_dispatched_before_an_earlier_bulk_one():
+    controller = AdmissionController(1, 4, 2, 5.0)
+    assert controller.acquire(INTERACTIVE)
+    admitted = []
+    bulk = queue_in_thread(controller, BULK, admitted)
+    wait_until(lambda: controller.stats()["waiting_bulk"] == 1)
+    interactive = queue_in_thread(controller, INTERACTIVE, admitted)
+    wait_until(lambda: controller.stats()["waiting_interactive"] == 1)
+    controller.release()
+    interactive.join(2)
+    assert admitted == [INTERACTIVE]
+    controller.release()
+    bulk.join(2)
+    assert admitted == [INTERACTIVE, BULK]
+
+
+def test_bulk_requests_only_fill_their_share_of_the_queue():
+    controller = AdmissionController(1, 4, 1, 5.0)
+    assert controller.acquire(INTERACTIVE)
+    admitted = []
+    thread = queue_in_thread(controller, BULK, admitted)
+    wait_until(lambda: controller.stats()["waiting_bulk"] == 1)
+    assert not controller.acquire(BULK)  # bulk share full, returned at once
+    assert controller.stats()["shed"][BULK] == 1
+    controller.release()
+    thread.join(2)
+
+
+def test_waiter_is_shed_after_the_queue_timeout():
+    controller = AdmissionController(1, 4, 2, 0.05)
+    assert controller.acquire(INTERACTIVE)
+    assert not controller.acquire(INTERACTIVE)
+    stats = controller.stats()
+    assert (stats["waiting_interactive"], stats["shed"][INTERACTIVE]) == (0, 1)
+
+
+def test_retry_after_follows_the_drain_rate(clock):
+    controller = AdmissionController(1, 4, 2, 10.0)
+    assert controller.retry_after() == 10  # nothing measured yet: the queue timeout
+    assert controller.acquire(INTERACTIVE)
+    admitted = []
+    threads = [queue_in_thread(controller, INTERACTIVE, admitted) for _ in range(3)]
+    wait_until(lambda: controller.stats()["waiting_interactive"] == 3)
+    for _ in range(2):
+        clock.now += 2.0  # one completion every two seconds under backlog
+        controller.release()
+    wait_until(lambda: len(admitted) == 2)
+    # The first release only starts the measurement, so the interval is the second sample: 2s
+    assert controller.retry_after() == 4  # (1 waiting + 1) x 2s
+    controller.release()
+    for thread in threads:
+        thread.join(2)
+
+
+def test_full_queue_returns_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "controller", AdmissionController(1, 0, 0, 3.0))
+    app = Flask(__name__)
+
+    @app.route("/work")
+    @admission.admit(lambda: INTERACTIVE)
+    def work():
+        return {"ok": True}
+
+    client = app.test_client()
+    held = client.get("/work")  # keeps its slot until the response is closed
+    assert held.status_code == 200
+    shed = client.get("/work")
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "3"
+    assert shed.get_json()["error"] == "Service Overloaded"
+    held.close()
+    assert client.get("/work").status_code == 200
@@ -0,0 +1,45 @@
+import json
+import pytest
+import script_context
+
+SEGMENT = {"text": "Hi!", "visual_representation_of_text": "A girl waves", "style_modifier": "warm light"}
+
+
+def test_parses_valid_document():
+    segments, style, repaired = script_context.parse(json.dumps({"segments": [SEGMENT], "script_scene_style": "anime"}))
+    assert [segment.to_dict() for segment in segments] == [SEGMENT]
+    assert style == "anime"
+    assert repaired is False
+
+
+def test_repairs_trailing_comma():
+    text = '{"segments": [{"text": "Hi!", "visual_representation_of_text": "A girl waves", ' \
+           '"style_modifier": "warm light",},], "script_scene_style": "anime",}'
+    segments, style, repaired = script_context.parse(text)
+    assert [segment.to_dict() for segment in segments] == [SEGMENT]
+    assert style == "anime"
+    assert repaired is True
+
+
+def test_repairs_code_fence_and_surrounding_prose():
+    text = 'Here you go:\n```json\n' + json.dumps({"segments": [SEGMENT], "script_scene_style": "anime"}) + '\n```'
+    segments, style, repaired = script_context.parse(text)
+    assert len(segments) == 1 and style == "anime" and repaired is True
+
+
+def test_missing_style_falls_back_to_default():
+    _, style, _ = script_context.parse(json.dumps({"segments": [SEGMENT]}))
+    assert style == script_context.DEFAULT_STYLE
+
+
+@pytest.mark.parametrize("field", ["text", "visual_representation_of_text"])
+def test_rejects_segment_missing_a_required_field(field):
+    segment = {key: value for key, value in SEGMENT.items() if key != field}
+    with pytest.raises(script_context.ScriptContextError, match=field):
+        script_context.parse(json.dumps({"segments": [segment], "script_scene_style": "anime"}))
+
+
+@pytest.mark.parametrize("text", ["", "not json", '{"script_scene_style": "anime"}', "[]"])
+def test_rejects_unusable_generations(text):
+    with pytest.raises(script_context.ScriptContextError):
+        script_context.parse(text)
@@ -0,0 +1,85 @@
+import xml.etree.ElementTree as ElementTree
+import pytest
+import ssml
+
+VOICE = "en-US-AshleyNeural"
+NS = {"ssml": "http://www.w3.org/2001/10/synthesis", "mstts": "https://www.w3.org/2001/mstts"}
+
+
+def normalize(raw):
+    return ssml.normalize(raw, VOICE, "cheerful", 1)
+
+
+def body(document):
+    """The markup inside <mstts:express-as>, as normalize wrote it."""
+    start = document.index(">", document.index("<mstts:express-as")) + 1
+    return document[start:document.rindex("</mstts:express-as>")]
+
+
+def test_wraps_reply_in_voice_and_style():
+    root = ElementTree.fromstring(normalize("Hello there!"))
+    assert root.find("ssml:voice", NS).get("name") == VOICE
+    express_as = root.find("ssml:voice/mstts:express-as", NS)
+    assert express_as.get("style") == "cheerful"
+    assert express_as.get("styledegree") == "1"
+    assert "".join(express_as.itertext()) == "Hello there!"
+
+
+def test_strips_code_fence_and_model_wrappers():
+    raw = '```xml\n<speak><voice name="other"><mstts:express-as style="sad">Hi!</mstts:express-as></voice></speak>\n```'
+    document = normalize(raw)
+    assert body(document) == "Hi!"
+    assert "```" not in document
+    assert 'name="other"' not in document
+
+
+def test_closes_unclosed_tags():
+    assert body(normalize('<prosody rate="slow">Hello <emphasis>there')) == \
+        '<prosody rate="slow">Hello <emphasis>there</emphasis></prosody>'
+
+
+def test_closes_tags_left_open_inside_a_closed_one():
+    assert body(normalize('<prosody rate="slow"><emphasis>Hi</prosody> you')) == \
+        '<prosody rate="slow"><emphasis>Hi</emphasis></prosody> you'
+
+
+def test_drops_stray_closing_tags():
+    assert body(normalize("Hello</prosody> there</break>")) == "Hello there"
+
+
+def test_self_closes_empty_elements():
+    assert body(normalize('Wait<break time="500ms">now')) == 'Wait<break time="500ms"/>now'
+
+
+def test_unwraps_unknown_elements():
+    assert body(normalize("<happy>Yay</happy>!")) == "Yay!"
+
+
+@pytest.mark.parametrize("tag", ["</!x>", "</?x>"])
+def test_drops_closing_tags_without_a_name(tag):
+    assert body(normalize(f"<speak>Hi {tag} there</speak>")) == "Hi  there"
+
+
+def test_drops_unknown_bookmarks_and_fixes_case():
+    document = normalize('<bookmark mark="Dance"/>Hi <bookmark mark="head-tilt"/>there')
+    assert body(document) == 'Hi <bookmark mark="Head-Tilt"/>there'
+
+
+def test_escapes_lone_less_than_and_ampersand():
+    document = normalize("Rock & roll is < jazz")
+    assert body(document) == "Rock &amp; roll is &lt; jazz"
+    assert "".join(ElementTree.fromstring(document).itertext()) == "Rock & roll is < jazz"
+
+
+def test_decodes_entities_before_escaping():
+    assert body(normalize("Tom &amp; Jerry&#39;s")) == "Tom &amp; Jerry's"
+
+
+def test_quotes_unquoted_attributes():
+    assert body(normalize("<prosody rate=slow>Hi</prosody>")) == '<prosody rate="slow">Hi</prosody>'
+
+
+@pytest.mark.parametrize("raw", ["", "```\n```", '<bookmark mark="Happy"/><break time="1s"/>'])
+def test_rejects_replies_with_nothing_to_speak(raw):
+    with pytest.raises(ssml.SSMLError):
+        normalize(raw)
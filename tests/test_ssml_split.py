@@ -0,0 +1,56 @@
+import xml.etree.ElementTree as ElementTree
+import ssml
+
+NS = {"ssml": "http://www.w3.org/2001/10/synthesis", "mstts": "https://www.w3.org/2001/mstts"}
+SENTENCES = [f"This is sentence number {n}, long enough to be spoken on its own." for n in range(8)]
+
+
+def document(body, voice="en-US-AshleyNeural"):
+    return ssml.normalize(body, voice, "cheerful", 2)
+
+
+def spoken(root):
+    return " ".join("".join(root.itertext()).split())
+
+
+def test_short_document_is_not_split():
+    short = document("Hello there!")
+    assert ssml.split_ssml(short, max_pieces=4, min_piece_chars=80) == [short]
+
+
+def test_max_pieces_one_disables_splitting():
+    long = document(" ".join(SENTENCES))
+    assert ssml.split_ssml(long, max_pieces=1, min_piece_chars=20) == [long]
+
+
+def test_pieces_are_well_formed_and_keep_the_text_in_order():
+    long = document(" ".join(SENTENCES))
+    pieces = ssml.split_ssml(long, max_pieces=4, min_piece_chars=60)
+    assert 1 < len(pieces) <= 4
+    roots = [ElementTree.fromstring(piece) for piece in pieces]
+    assert " ".join(spoken(root) for root in roots) == spoken(ElementTree.fromstring(long))
+
+
+def test_pieces_keep_voice_style_and_prosody():
+    long = document('<prosody rate="slow" pitch="+5%">' + " ".join(SENTENCES) + "</prosody>")
+    pieces = ssml.split_ssml(long, max_pieces=4, min_piece_chars=60)
+    assert len(pieces) > 1
+    for piece in pieces:
+        root = ElementTree.fromstring(piece)
+        assert root.find("ssml:voice", NS).get("name") == "en-US-AshleyNeural"
+        express_as = root.find("ssml:voice/mstts:express-as", NS)
+        assert (express_as.get("style"), express_as.get("styledegree")) == ("cheerful", "2")
+        prosody = express_as.find("ssml:prosody", NS)
+        assert (prosody.get("rate"), prosody.get("pitch")) == ("slow", "+5%")
+        assert spoken(prosody) == spoken(root)
+
+
+def test_cuts_at_breaks_and_keeps_bookmarks():
+    body = '<bookmark mark="Happy"/>' + SENTENCES[0].rstrip(".") + '<break time="300ms"/>' + SENTENCES[1] \
+        + ' <bookmark mark="Blink"/>' + SENTENCES[2]
+    pieces = ssml.split_ssml(document(body), max_pieces=3, min_piece_chars=40)
+    assert len(pieces) == 3
+    assert pieces[0].endswith('<break time="300ms"/></mstts:express-as></voice></speak>')
+    marks = [bookmark.get("mark") for piece in pieces for bookmark in ElementTree.fromstring(piece).iter(
+        "{http://www.w3.org/2001/10/synthesis}bookmark")]
+    assert marks == ["Happy", "Blink"]
@@ -0,0 +1,161 @@
+import asyncio
+import pytest
+import upstream
+
+
+class Clock:
+    """Stands in for time.monotonic, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_RETRY_BASE_DELAY", 0.0)
+
+
+def provider(rate=0.0, burst=1, max_concurrency=8, hedge=False):
+    return upstream.Provider("test", rate, burst, max_concurrency, hedge)
+
+
+def test_rate_limit_halves_the_limit_once_per_interval(clock, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_RETRIES", 0)
+    scheduler = provider()
+
+    async def rate_limited():
+        raise UpstreamError(429)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await scheduler.call(rate_limited)
+
+    asyncio.run(run())
+    assert scheduler.limit == 4  # the second 429 came within BACKOFF_INTERVAL
+    assert scheduler.rate_limited == 2
+    clock.now += upstream.BACKOFF_INTERVAL
+    with pytest.raises(UpstreamError):
+        asyncio.run(scheduler.call(rate_limited))
+    assert scheduler.limit == 2
+    assert scheduler.in_flight == 0
+
+
+def test_successes_grow_the_limit_back_additively(clock):
+    scheduler = provider()
+    scheduler.limit = 4.0
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        for _ in range(4):
+            await scheduler.call(ok)
+
+    asyncio.run(run())
+    assert 4.9 < scheduler.limit < 5.1  # one slot per limit's worth of successes
+    assert scheduler.max_concurrency >= scheduler.limit
+
+
+def test_retryable_error_is_retried_then_succeeds(clock):
+    scheduler = provider()
+    outcomes = [UpstreamError(503), "ok"]
+
+    async def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert asyncio.run(scheduler.call(flaky)) == "ok"
+    assert (scheduler.calls, scheduler.attempts, scheduler.retries) == (1, 2, 1)
+
+
+def test_non_retryable_error_is_raised_at_once(clock):
+    scheduler = provider()
+
+    async def bad_request():
+        raise UpstreamError(400)
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(scheduler.call(bad_request))
+    assert (scheduler.attempts, scheduler.retries) == (1, 0)
+
+
+def test_hedge_fires_after_the_delay_and_the_loser_is_cancelled(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_HEDGE_MIN_DELAY", 0.01)
+    scheduler = provider(max_concurrency=4, hedge=True)
+    scheduler.latencies.extend([0.001] * upstream.UPSTREAM_HEDGE_MIN_SAMPLES)
+    cancelled = []
+    attempts = []
+
+    async def slow_then_fast():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return f"attempt {len(attempts)}"
+
+    async def run():
+        result = await scheduler.call(slow_then_fast)
+        await asyncio.sleep(0)  # let the primary's cancellation land
+        return result
+
+    assert asyncio.run(run()) == "attempt 2"
+    assert (scheduler.hedges, scheduler.hedge_wins) == (1, 1)
+    assert cancelled == [True]
+    assert scheduler.in_flight == 0
+
+
+def test_token_bucket_refills_with_time(clock):
+    scheduler = provider(rate=10.0, burst=2)
+    assert scheduler._try_acquire() and scheduler._try_acquire()
+    assert not scheduler._try_acquire()  # bucket empty, though slots are free
+    clock.now += 0.1  # one token at 10/s
+    assert scheduler._try_acquire()
+    assert not scheduler._try_acquire()
+
+
+def test_concurrency_limit_queues_until_a_slot_is_released(clock):
+    scheduler = provider(max_concurrency=1)
+
+    async def run():
+        await scheduler._acquire()
+        waiting = asyncio.ensure_future(scheduler._acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done() and len(scheduler._waiters) == 1
+        scheduler._release()
+        await asyncio.wait_for(waiting, 1)
+        assert scheduler.in_flight == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("error, expected", [
+    (UpstreamError(429), upstream.RATE_LIMITED),
+    (UpstreamError(503), upstream.RETRYABLE),
+    (UpstreamError(400), None),
+    (ConnectionError("reset"), upstream.RETRYABLE),
+    (ValueError("bad"), None),
+])
+def test_classify(error, expected):
+    assert upstream.classify(error) == expected
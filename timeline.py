@@ -0,0 +1,132 @@
+"""Compact collector for Azure synthesis timing events.
+
+Viseme events arrive at a very high rate, so the SDK callbacks only append integer ticks and ids to
+typed array buffers, one set per event type. Conversion to the response format (seconds, or columnar
+milliseconds) happens once, when the reply is serialized.
+"""
+from array import array
+from heapq import merge
+
+TICKS_PER_SECOND = 10_000_000  # Azure audio offsets are in 100-ns ticks
+TICKS_PER_MS = 10_000
+
+TIMING_FORMATS = ("objects", "columnar", "columnar-delta")
+
+
+class TimelineCollector:
+    __slots__ = ("viseme_ticks", "viseme_ids", "word_ticks", "words", "bookmark_ticks", "marks")
+
+    def __init__(self):
+        self.viseme_ticks = array("q")
+        self.viseme_ids = array("H")
+        self.word_ticks = array("q")
+        self.words = []
+        self.bookmark_ticks = array("q")
+        self.marks = []
+
+    # SDK event handlers
+
+    def on_viseme(self, evt):
+        self.viseme_ticks.append(evt.audio_offset)
+        self.viseme_ids.append(evt.viseme_id)
+
+    def on_word(self, evt):
+        self.word_ticks.append(evt.audio_offset)
+        self.words.append(evt.text)  # Captures the word text from the event
+
+    def on_bookmark(self, evt):
+        self.bookmark_ticks.append(evt.audio_offset)
+        self.marks.append(evt.text)  # The 'mark' attribute from the <bookmark> tag
+
+    def handlers(self):
+        return {
+            "viseme_received": self.on_viseme,
+            "synthesis_word_boundary": self.on_word,
+            "bookmark_reached": self.on_bookmark,
+        }
+
+    # Building timelines
+
+    def extend(self, other, offset_ticks=0):
+        """Append another timeline, shifted by offset_ticks (the audio that precedes it)."""
+        self.viseme_ticks.extend(t + offset_ticks for t in other.viseme_ticks)
+        self.viseme_ids.extend(other.viseme_ids)
+        self.word_ticks.extend(t + offset_ticks for t in other.word_ticks)
+        self.words.extend(other.words)
+        self.bookmark_ticks.extend(t + offset_ticks for t in other.bookmark_ticks)
+        self.marks.extend(other.marks)
+
+    @property
+    def nbytes(self):
+        return (self.viseme_ticks.itemsize * len(self.viseme_ticks) + self.viseme_ids.itemsize * len(self.viseme_ids)
+                + self.word_ticks.itemsize * len(self.word_ticks) + self.bookmark_ticks.itemsize * len(self.bookmark_ticks)
+                + sum(len(w) for w in self.words) + sum(len(m) for m in self.marks))
+
+    def to_raw(self):
+        # Lossless form used by the TTS cache
+        return {
+            "viseme_ticks": self.viseme_ticks.tolist(),
+            "viseme_ids": self.viseme_ids.tolist(),
+            "word_ticks": self.word_ticks.tolist(),
+            "words": self.words,
+            "bookmark_ticks": self.bookmark_ticks.tolist(),
+            "marks": self.marks,
+        }
+
+    @classmethod
+    def from_raw(cls, raw):
+        timeline = cls()
+        timeline.viseme_ticks.extend(raw["viseme_ticks"])
+        timeline.viseme_ids.extend(raw["viseme_ids"])
+        timeline.word_ticks.extend(raw["word_ticks"])
+        timeline.words.extend(raw["words"])
+        timeline.bookmark_ticks.extend(raw["bookmark_ticks"])
+        timeline.marks.extend(raw["marks"])
+        return timeline
+
+    # Serialization
+
+    def to_timings(self, timing_format="objects"):
+        """Return the phoneme_timings / word_timings / bookmark_timings fields of the response.
+
+        "objects" is the classic [{"time": seconds, ...}] lists. "columnar" returns parallel
+        {"times": [ms...], "visemes": [...]} arrays per type, and "columnar-delta" additionally
+        stores each time as the difference from the previous one.
+        """
+        if timing_format == "objects":
+            return {
+                "phoneme_timings": [{"time": t / TICKS_PER_SECOND, "viseme": v}
+                                    for t, v in zip(self.viseme_ticks, self.viseme_ids)],
+                "word_timings": [{"time": t / TICKS_PER_SECOND, "word": w}
+                                 for t, w in zip(self.word_ticks, self.words)],
+                "bookmark_timings": [{"time": t / TICKS_PER_SECOND, "mark": m}
+                                     for t, m in zip(self.bookmark_ticks, self.marks)],
+            }
+        delta = timing_format == "columnar-delta"
+        return {
+            "phoneme_timings": {"times": _ms(self.viseme_ticks, delta), "visemes": self.viseme_ids.tolist()},
+            "word_timings": {"times": _ms(self.word_ticks, delta), "words": list(self.words)},
+            "bookmark_timings": {"times": _ms(self.bookmark_ticks, delta), "marks": list(self.marks)},
+        }
+
+    def events(self):
+        """All timing events as streaming-style dicts, merged into one time-ordered sequence."""
+        visemes = ((t, "viseme", v) for t, v in zip(self.viseme_ticks, self.viseme_ids))
+        words = ((t, "word", w) for t, w in zip(self.word_ticks, self.words))
+        bookmarks = ((t, "bookmark", m) for t, m in zip(self.bookmark_ticks, self.marks))
+        for ticks, kind, value in merge(visemes, words, bookmarks, key=lambda e: e[0]):
+            yield event_dict(kind, ticks, value)
+
+
+_EVENT_FIELDS = {"viseme": "viseme", "word": "word", "bookmark": "mark"}
+
+
+def event_dict(kind, ticks, value):
+    return {"type": kind, "time": ticks / TICKS_PER_SECOND, _EVENT_FIELDS[kind]: value}
+
+
+def _ms(ticks, delta):
+    times = [(t + TICKS_PER_MS // 2) // TICKS_PER_MS for t in ticks]  # round to integer milliseconds
+    if delta:
+        times = [t - p for t, p in zip(times, [0] + times[:-1])]
+    return times
@@ -0,0 +1,253 @@
+"""Content-addressed cache for finished speech syntheses.
+
+Entries hold the audio bytes together with the TimelineCollector of its viseme/word/bookmark
+events, keyed on a hash of the normalized SSML, voice and output format. A size-bounded
+in-memory LRU sits in front of an on-disk tier that every gunicorn worker on the host shares;
+disk entries are read through mmap so concurrent workers are served from the same page cache.
+"""
+import os
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+import time
+import logging
+from collections import OrderedDict
+from timeline import TimelineCollector
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_TTL = float(os.environ.get("TTS_CACHE_TTL", 24 * 3600))  # seconds
+TTS_CACHE_MEMORY_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))  # 0 disables the memory tier
+TTS_CACHE_DISK_BYTES = int(os.environ.get("TTS_CACHE_DISK_BYTES", 512 * 1024 * 1024))  # 0 disables the disk tier
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "ai-anime-dating-tts")
+TTS_CACHE_SWEEP_INTERVAL = float(os.environ.get("TTS_CACHE_SWEEP_INTERVAL", 60))  # seconds between disk sweeps
+
+_MAGIC = b"TTSC\x02"
+_HEADER = struct.Struct(">dI")  # expires_at (unix time), timeline header length
+
+
+def cache_key(ssml, voice, output_format):
+    # SSML collapses whitespace runs, so formatting differences from the LLM must not split entries
+    normalized = " ".join(ssml.split())
+    digest = hashlib.sha256()
+    for part in (normalized, voice, output_format):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _entry_size(entry):
+    return len(entry["audio_data"]) + entry["timeline"].nbytes
+
+
+class TTSCache:
+    def __init__(self, ttl, memory_bytes, disk_bytes, directory):
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (expires_at, size, entry)
+        self._memory_used = 0
+        self._last_sweep = 0.0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Memory tier
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            item = self._memory.get(key)
+            if item is None:
+                return None
+            expires_at, size, entry = item
+            if expires_at <= now:
+                del self._memory[key]
+                self._memory_used -= size
+                self.expirations += 1
+                return None
+            self._memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key, entry, expires_at):
+        size = _entry_size(entry)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= old[1]
+            self._memory[key] = (expires_at, size, entry)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted_size, _) = self._memory.popitem(last=False)
+                self._memory_used -= evicted_size
+                self.evictions += 1
+
+    # Disk tier
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".tts")
+
+    def _disk_get(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(_MAGIC)] != _MAGIC:
+                    raise ValueError("bad magic")
+                expires_at, header_len = _HEADER.unpack_from(mm, len(_MAGIC))
+                if expires_at <= now:
+                    with self._lock:
+                        self.expirations += 1
+                    self._remove(path)
+                    return None, 0.0
+                start = len(_MAGIC) + _HEADER.size
+                header = json.loads(mm[start:start + header_len])
+                entry = {
+                    "audio_data": mm[start + header_len:],
+                    "audio_duration": header.get("audio_duration"),
+                    "timeline": TimelineCollector.from_raw(header),
+                }
+                return entry, expires_at
+        except FileNotFoundError:
+            return None, 0.0
+        except Exception as e:
+            # Truncated or corrupt entries (e.g. empty files that can't be mapped) are dropped
+            logger.error(f"Discarding unreadable TTS cache entry {path}: {str(e)}")
+            self._remove(path)
+            return None, 0.0
+
+    def _disk_put(self, key, entry, expires_at):
+        path = self._path(key)
+        header = {**entry["timeline"].to_raw(), "audio_duration": entry["audio_duration"]}
+        header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so other workers never map a half-written entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_MAGIC)
+                f.write(_HEADER.pack(expires_at, len(header)))
+                f.write(header)
+                f.write(entry["audio_data"])
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Failed to write TTS cache entry to disk: {str(e)}")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _maybe_sweep(self, now):
+        with self._lock:
+            if now - self._last_sweep < TTS_CACHE_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        self.sweep(now)
+
+    def sweep(self, now=None):
+        """Drop expired disk entries, then the oldest ones until the disk tier fits its budget."""
+        now = time.time() if now is None else now
+        files = []
+        try:
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for item in os.scandir(shard.path):
+                    stat = item.stat()
+                    # Files are written once, so mtime + TTL is the entry's expiry time
+                    if stat.st_mtime + self.ttl <= now:
+                        self._remove(item.path)
+                        with self._lock:
+                            self.expirations += 1
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, item.path))
+        except FileNotFoundError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    # Public API
+
+    def get(self, key):
+        now = time.time()
+        if self.memory_bytes > 0:
+            entry = self._memory_get(key, now)
+            if entry is not None:
+                with self._lock:
+                    self.memory_hits += 1
+                return entry
+        if self.disk_bytes > 0:
+            entry, expires_at = self._disk_get(key, now)
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                if self.memory_bytes > 0:
+                    self._memory_put(key, entry, expires_at)
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        now = time.time()
+        expires_at = now + self.ttl
+        entry = {
+            "audio_data": bytes(entry["audio_data"]),
+            "audio_duration": entry.get("audio_duration"),
+            "timeline": entry["timeline"],
+        }
+        if self.memory_bytes > 0:
+            self._memory_put(key, entry, expires_at)
+        if self.disk_bytes > 0:
+            self._disk_put(key, entry, expires_at)
+            self._maybe_sweep(now)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+_cache = TTSCache(TTS_CACHE_TTL, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DISK_BYTES, TTS_CACHE_DIR)
+
+
+def get(key):
+    return _cache.get(key)
+
+
+def put(key, entry):
+    _cache.put(key, entry)
+
+
+def stats():
+    return _cache.stats()
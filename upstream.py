@@ -0,0 +1,343 @@
+"""Scheduler for the upstream calls of each worker: every Gemini generation and Azure synthesis goes through it.
+
+Each provider gets a token bucket capping its request rate, an AIMD concurrency limit (halved on a
+429, grown back by one slot per limit's worth of successes), jittered exponential retries for
+retryable errors, and for Gemini a hedged duplicate attempt when a call runs past the provider's recent
+p95 latency, whichever attempt finishes first wins. Like the calls it schedules, all of this runs on the
+worker's upstream event loop, so the state needs no locks; it is rebuilt in forked workers.
+"""
+import os
+import sys
+import random
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from time import monotonic
+import client_pool
+import metrics
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", 2))  # extra attempts after a retryable error
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get("UPSTREAM_RETRY_BASE_DELAY", 0.2))  # seconds, doubled per attempt
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get("UPSTREAM_RETRY_MAX_DELAY", 2.0))  # seconds
+UPSTREAM_HEDGE = os.environ.get("UPSTREAM_HEDGE", "true").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_MIN_DELAY = float(os.environ.get("UPSTREAM_HEDGE_MIN_DELAY", 0.25))  # seconds, floor of the p95 delay
+UPSTREAM_HEDGE_BUDGET = float(os.environ.get("UPSTREAM_HEDGE_BUDGET", 0.1))  # max fraction of calls hedged
+UPSTREAM_HEDGE_MIN_SAMPLES = 20  # latencies needed before the p95 is trusted
+BACKOFF_INTERVAL = 1.0  # seconds; 429s of calls already in flight together only halve the limit once
+LATENCY_WINDOW = 256  # recent successful attempts the p95 is computed over
+
+# Per provider: requests per second (0 disables the bucket), bucket size, the ceiling of the adaptive limit,
+# and whether slow calls are hedged. Each Azure call holds a pooled synthesizer, so its limit never exceeds
+# the pool; a hedge would hold a second one, and the loser's connection would have to be discarded.
+PROVIDERS = {
+    "gemini": (float(os.environ.get("GEMINI_RATE_LIMIT", 20)), int(os.environ.get("GEMINI_BURST", 40)),
+               int(os.environ.get("GEMINI_MAX_CONCURRENCY", 64)), True),
+    "azure": (float(os.environ.get("AZURE_RATE_LIMIT", 20)), int(os.environ.get("AZURE_BURST", 20)),
+              min(int(os.environ.get("AZURE_MAX_CONCURRENCY", 32)), client_pool.SYNTHESIZER_POOL_SIZE), False),
+}
+
+RATE_LIMITED = "rate_limited"
+RETRYABLE = "retryable"
+RETRYABLE_STATUS = {408, 500, 502, 503, 504}
+# Azure CancellationErrorCode names worth another attempt (see app.synthesis_failure)
+RETRYABLE_AZURE_CODES = {"ConnectionFailure", "ServiceTimeout", "ServiceError", "ServiceUnavailable"}
+
+UPSTREAM_RETRIED = metrics.Counter("upstream_retries_total", "Upstream attempts retried, by provider", ("provider",))
+UPSTREAM_HEDGED = metrics.Counter("upstream_hedges_total", "Hedged duplicate attempts by provider and winner",
+                                  ("provider", "winner"))
+UPSTREAM_RATE_LIMITED = metrics.Counter("upstream_rate_limited_total", "429 responses by provider", ("provider",))
+
+
+def classify(error):
+    """RATE_LIMITED, RETRYABLE, or None for errors another attempt won't fix."""
+    code = getattr(error, "code", None)  # google.genai APIError status
+    azure_code = getattr(error, "upstream_code", None)  # set on Azure cancellations by app.synthesis_failure
+    if code == 429 or azure_code == "TooManyRequests":
+        return RATE_LIMITED
+    if code in RETRYABLE_STATUS or azure_code in RETRYABLE_AZURE_CODES:
+        return RETRYABLE
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return RETRYABLE
+    # httpx is only loaded with the Gemini SDK, and until then none of its errors can be raised
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return RETRYABLE
+    return None
+
+
+class Provider:
+    def __init__(self, name, rate, burst, max_concurrency, hedge=True):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.hedge = hedge and UPSTREAM_HEDGE
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.refilled = monotonic()
+        self.backed_off = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._p95 = None
+        self._p95_samples = 0
+        self._waiters = deque()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rate_limited = 0
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def _try_acquire(self):
+        if self.in_flight >= int(self.limit):
+            return False
+        if self.rate:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        self.in_flight += 1
+        return True
+
+    async def _acquire(self):
+        while not self._try_acquire():
+            # Woken by a released slot, or when the next token is due if the bucket is what's empty
+            token_delay = (1 - self.tokens) / self.rate if self.rate and self.in_flight < int(self.limit) else None
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, token_delay)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # pass on the slot this waiter was woken for
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def hedge_delay(self):
+        """Recent p95 latency of this provider, or None until enough calls have been seen."""
+        if len(self.latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        # Re-sorting the window on every call would cost more than the calls it schedules
+        if self._p95 is None or self._p95_samples >= 16:
+            ordered = sorted(self.latencies)
+            self._p95 = ordered[int(len(ordered) * 0.95) - 1]
+            self._p95_samples = 0
+        return max(UPSTREAM_HEDGE_MIN_DELAY, self._p95)
+
+    def _succeeded(self, latency=None):
+        if latency is not None:
+            self.latencies.append(latency)
+            self._p95_samples += 1
+        # Additive increase: one more slot after a full limit's worth of successful calls
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _failed(self, error):
+        if classify(error) == RATE_LIMITED:
+            self.rate_limited += 1
+            UPSTREAM_RATE_LIMITED.inc(1, self.name)
+            if monotonic() - self.backed_off >= BACKOFF_INTERVAL:
+                # Multiplicative decrease: the provider is telling us we're above its quota
+                self.limit = max(1.0, self.limit / 2)
+                self.backed_off = monotonic()
+                logger.info(f"{self.name} rate limited, concurrency limit lowered to {int(self.limit)}")
+
+    async def _attempt(self, fn, acquired=False, prepare=None):
+        if not acquired:
+            await self._acquire()
+        try:
+            # Waiting on a local resource, like a pooled synthesizer, isn't the provider's latency
+            args = () if prepare is None else (await prepare(),)
+            self.attempts += 1
+            start = monotonic()
+            result = await fn(*args)
+        except Exception as e:
+            self._failed(e)
+            raise
+        finally:
+            self._release()
+        self._succeeded(monotonic() - start)
+        return result
+
+    def _try_hedge(self):
+        # Hedges only use spare capacity: never past the budget, ahead of queued calls, or over the limit
+        if self.hedges >= UPSTREAM_HEDGE_BUDGET * self.calls or self._waiters:
+            return False
+        if not self._try_acquire():
+            return False
+        self.hedges += 1
+        return True
+
+    async def _hedged(self, fn, prepare=None):
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._attempt(fn, prepare=prepare))
+        tasks = {primary}
+        hedged = False
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._try_hedge():
+                    logger.info(f"{self.name} call running past {delay:.2f}s, sending a hedged attempt")
+                    tasks.add(asyncio.ensure_future(self._attempt(fn, acquired=True, prepare=prepare)))
+                    hedged = True
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if hedged:
+                            UPSTREAM_HEDGED.inc(1, self.name, "primary" if task is primary else "hedge")
+                            self.hedge_wins += task is not primary
+                        return task.result()
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, fn, prepare=None):
+        """Await fn(), a coroutine function, with rate limiting, hedging and retries.
+
+        prepare, if given, is a coroutine function awaited before each attempt once it holds a slot; its
+        result is passed to fn and the time it takes is left out of the latencies hedging is based on.
+        """
+        self.calls += 1
+        for attempt in range(UPSTREAM_RETRIES + 1):
+            try:
+                if self.hedge:
+                    return await self._hedged(fn, prepare)
+                return await self._attempt(fn, prepare=prepare)
+            except Exception as e:
+                if attempt == UPSTREAM_RETRIES or classify(e) is None:
+                    raise
+                # Full jitter, so callers that failed together don't retry in lockstep
+                delay = random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+                self.retries += 1
+                UPSTREAM_RETRIED.inc(1, self.name)
+                logger.info(f"Retrying {self.name} call in {delay:.2f}s after: {str(e)}")
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        p95 = self._p95  # last computed on the loop, the window itself may be changing under us
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rate_limited": self.rate_limited,
+        }
+
+
+_owner_pid = None
+_providers = {}
+
+
+def get_provider(name):
+    global _owner_pid, _providers
+    # Forked gunicorn workers start over instead of sharing the parent's counters and waiters
+    if _owner_pid != os.getpid():
+        _owner_pid = os.getpid()
+        _providers = {}
+    provider = _providers.get(name)
+    if provider is None:
+        provider = _providers[name] = Provider(name, *PROVIDERS[name])
+    return provider
+
+
+async def call(provider, fn, prepare=None):
+    """Schedule one upstream call on the named provider ("gemini" or "azure"); fn returns a fresh coroutine."""
+    return await get_provider(provider).call(fn, prepare)
+
+
+class SlotTimeout(Exception):
+    """No slot of the provider came free within the time slot() was given.
+
+    Not a TimeoutError: the provider never saw the call, so classify() mustn't take it for one of its timeouts.
+    """
+
+
+async def _hold(name, timeout):
+    provider = get_provider(name)
+    provider.calls += 1
+    try:
+        # Given up on the loop, where a slot granted at the last moment is still returned by wait_for
+        await asyncio.wait_for(provider._acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise SlotTimeout(f"No {name} slot came free within {timeout}s "
+                          f"({provider.in_flight} in flight, limit {int(provider.limit)})")
+    provider.attempts += 1
+    return provider
+
+
+def _settle(provider, error):
+    if error is None:
+        provider._succeeded()
+    else:
+        provider._failed(error)
+    provider._release()
+
+
+@contextmanager
+def slot(name, timeout):
+    """Hold one of the named provider's slots around a call made outside the scheduler, from a request thread.
+
+    For calls that can't go through call(), like a streamed synthesis whose audio is already on its way to
+    the client: they aren't retried, hedged or timed, but count against the provider's limit and token
+    bucket, and a 429 raised inside the block lowers the limit like any other. Raises SlotTimeout when
+    no slot comes free within timeout seconds.
+    """
+    future = client_pool.submit(_hold(name, timeout))
+    try:
+        # _hold times out by itself; this only outlasts it if the loop is stuck
+        provider = future.result(timeout + 1)
+    except FutureTimeoutError:
+        future.cancel()
+        raise SlotTimeout(f"No {name} slot came free within {timeout}s")
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        # The scheduler's state belongs to the upstream loop
+        client_pool.get_event_loop().call_soon_threadsafe(_settle, provider, error)
+
+
+def concurrency_limit(name):
+    """Current adaptive concurrency limit of a provider; safe to read from request threads."""
+    provider = _providers.get(name) if _owner_pid == os.getpid() else None
+    return int(provider.limit) if provider is not None else PROVIDERS[name][2]
+
+
+def stats():
+    return {name: provider.stats() for name, provider in _providers.items()} if _owner_pid == os.getpid() else {}